@@ -1,18 +1,180 @@
-from flask import Flask, render_template, request, jsonify, Response, send_file, send_from_directory
+from flask import Flask, render_template, request, jsonify, Response, send_file, send_from_directory, g, has_request_context
 import os
-from whoosh.index import create_in, open_dir
-from whoosh.fields import Schema, TEXT, ID, STORED
+import logging
+from whoosh.index import create_in, open_dir, exists_in
+from whoosh.reading import MultiReader, EmptyReader
+from whoosh.searching import Searcher
+from whoosh.fields import Schema, TEXT, ID, STORED, COLUMN
+from whoosh.columns import NumericColumn
 from whoosh.analysis import RegexTokenizer
-from whoosh.qparser import QueryParser, OrGroup
+from whoosh.highlight import highlight, ContextFragmenter, HtmlFormatter
+from whoosh.collectors import WrappingCollector
+from whoosh.query import PatternQuery, SpanWrappingMatcher, Term, Phrase, Prefix, Wildcard, And, Or, Not, AndNot, NullQuery
 import pdfplumber
+import pypdfium2 as pdfium
+import io
 from pathlib import Path
 import json
+import hashlib
+import sqlite3
+import zlib
+import unicodedata
 from PyPDF2 import PdfReader
 from functools import lru_cache
+from contextlib import contextmanager
+from collections import OrderedDict, namedtuple, deque
+import threading
+import gc
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+import multiprocessing
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, Future, wait, FIRST_COMPLETED, TimeoutError as FutureTimeout
 import re
 
 app = Flask(__name__)
 
+# Level of the app's log messages, e.g. BOOKSEARCH_LOG_LEVEL=DEBUG. Details of
+# every search are logged at DEBUG, so at the default level the search path
+# does no logging I/O.
+LOG_LEVEL = os.environ.get('BOOKSEARCH_LOG_LEVEL', 'INFO').upper()
+logging.basicConfig(format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+logger = logging.getLogger('booksearch')
+logger.setLevel(LOG_LEVEL)
+
+# Upper bounds (seconds) of the timing histogram buckets on /metrics
+METRIC_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class Metric:
+    """A Prometheus-style metric of this process, with values per label set"""
+
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _label_text(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self.render_value(key, value) for key, value in items)
+        return lines
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def items(self):
+        """(label values, count) pairs"""
+        with self._lock:
+            return list(self._values.items())
+
+    def render_value(self, key, value):
+        return f"{self.name}{self._label_text(key)} {value}"
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=METRIC_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0, 0.0]  # bucket counts, count, sum
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += 1
+            state[2] += value
+
+    def render_value(self, key, state):
+        counts, count, total = state
+        lines = [f"{self.name}_bucket{self._label_text(key, [('le', bound)])} {n}"
+                 for bound, n in zip(self.buckets, counts)]
+        lines.append(f"{self.name}_bucket{self._label_text(key, [('le', '+Inf')])} {count}")
+        lines.append(f"{self.name}_count{self._label_text(key)} {count}")
+        lines.append(f"{self.name}_sum{self._label_text(key)} {total:.6f}")
+        return '\n'.join(lines)
+
+_metrics = []
+
+request_seconds = Histogram('booksearch_request_seconds',
+                            'Time from receiving a request to the end of its response (streams included)',
+                            ('endpoint',))
+stage_seconds = Histogram('booksearch_stage_seconds',
+                          'Time spent in each stage of handling a search', ('stage',))
+cache_requests = Counter('booksearch_cache_requests_total',
+                         'Lookups in the caches, by cache and hit or miss', ('cache', 'result'))
+extract_book_seconds = Histogram('booksearch_extract_book_seconds',
+                                 'Time to get the text of one book while indexing', ('source',))
+extract_page_seconds = Histogram('booksearch_extract_page_seconds',
+                                 'Time to extract the text of one page, by extraction backend', ('backend',))
+index_stage_seconds = Histogram('booksearch_index_stage_seconds',
+                                'Time spent writing the index, by stage', ('stage',))
+indexed_pages = Counter('booksearch_indexed_pages_total', 'Pages added to the index')
+
+@contextmanager
+def timed(stage):
+    """Time a stage of a search into the stage histogram and the request's Server-Timing"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_seconds.observe(elapsed, stage=stage)
+        if has_request_context():
+            timings = g.setdefault('timings', {})
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+
+def count_cache_lookup(cache, hit):
+    cache_requests.inc(cache=cache, result='hit' if hit else 'miss')
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def add_server_timing(response):
+    """Report the stage timings so far as a Server-Timing header.
+
+    A streamed response sends its headers before the stream runs, so it
+    only reports the stages done before the first line; the full duration
+    is recorded in the request histogram once the response is closed.
+    """
+    timings = g.get('timings')
+    if timings:
+        response.headers['Server-Timing'] = ', '.join(
+            f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in timings.items())
+    start, endpoint = g.get('request_start'), request.endpoint or 'unknown'
+    if start is not None:
+        response.call_on_close(lambda: request_seconds.observe(time.perf_counter() - start, endpoint=endpoint))
+    return response
+
 # Schema for our search index
 # For case-sensitive search, we need an analyzer that does NOT lowercase the text
 # Whoosh's default TEXT field uses StandardAnalyzer which includes LowercaseFilter
@@ -23,88 +185,1007 @@ schema = Schema(
     path=ID(stored=True),
     filename=STORED,
     page_num=STORED,
-    content=TEXT(stored=True),  # Normal case-insensitive field (includes LowercaseFilter)
-    content_case=TEXT(stored=True, analyzer=case_sensitive_analyzer)  # Case-sensitive field (no lowercasing)
+    content=TEXT,  # Normal case-insensitive field (includes LowercaseFilter)
+    content_case=TEXT(analyzer=case_sensitive_analyzer),  # Case-sensitive field (no lowercasing)
+    # Both fields above are indexed from the same text but store nothing; the
+    # page text is stored once, zlib-compressed, for snippets
+    page_text=STORED,
+    # The last words of the page followed by the first words of the next one,
+    # indexed (not stored) so phrases running across the page break are found
+    content_span=TEXT,
+    # Number of content_span tokens that belong to this page
+    span_split=COLUMN(NumericColumn('H'))
 )
 
-@lru_cache(maxsize=1000)
-def get_pdf_title(filename):
-    """Extract title from PDF metadata with caching"""
+# Words taken from each side of a page break for content_span. A phrase that
+# crosses the break is found if it has at most this many words on either
+# side; 0 turns page-boundary phrase search off (indexing and querying).
+PAGE_OVERLAP_WORDS = 10
+
+def compress_page_text(text):
+    """Encode page text for the page_text stored field"""
+    return zlib.compress(text.encode('utf-8'))
+
+def get_page_text(fields):
+    """Return the page text from a stored-fields dict (e.g. hit.fields())"""
+    if 'page_text' in fields:
+        return zlib.decompress(fields['page_text']).decode('utf-8')
+    # Indexes built before page_text existed stored the text in 'content'
+    return fields.get('content', '')
+
+def index_schema_is_current(ix):
+    """True if the index on disk was created with the current schema"""
+    return sorted(ix.schema.names()) == sorted(schema.names())
+
+def search_title(title):
+    """Title without its "GA nnn - " prefix (e.g. "GA 261 - ", "GA_082 - "), for search purposes"""
+    # If stripping the prefix results in an empty string, use the original title
+    return re.sub(r'^\s*GA[_\s-]*\d+[A-Za-z]*\s*-\s*', '', title).strip() or title
+
+def read_book_metadata(pdf_path):
+    """Read title and page count of a PDF; only called while indexing, never per request"""
+    title = pdf_path.name.replace('.pdf', '')
+    page_count = None
     try:
-        pdf_path = Path('data') / filename
-        if not pdf_path.exists():
-            return filename
-        
         reader = PdfReader(pdf_path)
         metadata = reader.metadata
         if metadata and metadata.get('/Title'):
-            title = metadata['/Title']
-            # Strip off any "GA ..." prefix from the title string, e.g., "GA 261 - "
-            cleaned_title = re.sub(r'^\s*GA\s+\d+\s*-\s*', '', title).strip()
-            # If stripping the prefix results in an empty string, use the original title
-            # return cleaned_title if cleaned_title else title
-            return title
-        
-        # If no metadata title, return filename without .pdf
-        return filename.replace('.pdf', '')
+            title = str(metadata['/Title'])
+        page_count = len(reader.pages)
     except Exception as e:
-        print(f"Error extracting title from {filename}: {e}")
-        return filename
+        logger.warning("Error reading metadata from %s: %s", pdf_path.name, e)
+    return {"title": title, "search_title": search_title(title), "page_count": page_count}
+
+def get_pdf_title(filename):
+    """Title of an indexed book from the book metadata, or the filename without .pdf"""
+    entry = get_book_metadata(filename)
+    if entry and entry.get('title'):
+        return entry['title']
+    return filename.replace('.pdf', '')
+
+# The index can be split into INDEX_SHARDS shard indexes (index/shard00, ...),
+# each holding a fixed subset of the books, so a query can be run on all
+# shards in parallel processes. With 1 shard the index lives in index/ itself.
+# Changing the number of shards requires rebuild_index.py.
+INDEX_DIR = 'index'
+INDEX_SHARDS = 1
+
+def shard_dir(shard):
+    """Directory of one index shard"""
+    if INDEX_SHARDS == 1:
+        return INDEX_DIR
+    return os.path.join(INDEX_DIR, f"shard{shard:02d}")
+
+def book_shard(filename):
+    """Shard a book is indexed in; a stable hash of its filename"""
+    if INDEX_SHARDS == 1:
+        return 0
+    return int(hashlib.sha1(filename.encode('utf-8')).hexdigest(), 16) % INDEX_SHARDS
+
+def init_index(shard=0):
+    """Initialize or open the search index (one shard of it, if sharded)"""
+    dirname = shard_dir(shard)
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    # The directory may exist without an index, e.g. holding only the job checkpoint
+    if not exists_in(dirname):
+        return create_in(dirname, schema)
+    return open_dir(dirname)
+
+def index_is_current():
+    """True if every shard uses the current schema and the layout matches INDEX_SHARDS"""
+    shard_dirs = [p for p in Path(INDEX_DIR).glob('shard*') if exists_in(str(p))]
+    if INDEX_SHARDS == 1 and shard_dirs:
+        return False
+    if INDEX_SHARDS > 1 and exists_in(INDEX_DIR):
+        return False
+    return all(index_schema_is_current(init_index(shard)) for shard in range(INDEX_SHARDS))
+
+def reader_generation(ix, reader):
+    """Generation of a reader; an empty index's EmptyReader reports -1 instead"""
+    return ix.latest_generation() if isinstance(reader, EmptyReader) else reader.generation()
+
+class ShardedIndex:
+    """All shards presented as one index to SearcherManager.
+
+    Its readers combine the segment readers of every shard in shard order,
+    so document numbers run over all shards, with shard i's documents
+    starting at reader.shard_offsets[i]. The generation is the tuple of
+    the shards' generations.
+    """
+
+    def __init__(self):
+        self.shards = [init_index(shard) for shard in range(INDEX_SHARDS)]
 
-def init_index():
-    """Initialize or open the search index"""
-    if not os.path.exists("index"):
-        os.mkdir("index")
-        return create_in("index", schema)
-    return open_dir("index")
+    def latest_generation(self):
+        return tuple(ix.latest_generation() for ix in self.shards)
+
+    def reader(self, reuse=None):
+        leaves, offsets, generations = [], [], []
+        base = 0
+        for ix in self.shards:
+            shard_reader = ix.reader()
+            generations.append(reader_generation(ix, shard_reader))
+            offsets.append(base)
+            for leaf, _ in shard_reader.leaf_readers():
+                if leaf.doc_count_all():
+                    leaves.append(leaf)
+                    base += leaf.doc_count_all()
+                else:
+                    # Left out of the MultiReader, so closing it would not close this one
+                    leaf.close()
+        reader = MultiReader(leaves, generation=tuple(generations)) if leaves else EmptyReader(schema)
+        reader.shard_offsets = offsets
+        reader.shard_generations = tuple(generations)
+        if reuse is not None:
+            # Searcher.refresh() expects the old reader to be closed by reader(reuse=...)
+            reuse.close()
+        return reader
+
+    def searcher(self):
+        return Searcher(self.reader(), fromindex=self)
+
+def open_search_index():
+    """The index searched by SearcherManager: the index itself, or all shards combined"""
+    return init_index() if INDEX_SHARDS == 1 else ShardedIndex()
+
+class SearcherManager:
+    """Process-wide searcher shared by all search requests.
+
+    Opening the index and a searcher per request rebuilds segment readers,
+    lexicons and caches every time. This keeps one searcher open and only
+    refreshes it when the index generation changes, reusing the readers of
+    unchanged segments. A searcher that is still being used by a request
+    when a new generation appears is not refreshed in place (that would
+    close readers under the request); a new one is opened and the old one
+    is closed when its last user releases it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ix = None
+        self._searcher = None
+        self._users = {}  # id(searcher) -> number of requests using it
+        self._retired = {}  # id(searcher) -> searcher to close once unused
+
+    def acquire(self):
+        """Return the current searcher, refreshed if the index has changed"""
+        with self._lock:
+            if self._ix is None:
+                self._ix = open_search_index()
+            current = self._searcher
+            if current is None:
+                current = self._ix.searcher()
+            elif not current.up_to_date():
+                if self._users.get(id(current)):
+                    self._retired[id(current)] = current
+                    current = self._ix.searcher()
+                else:
+                    current = current.refresh()
+            self._searcher = current
+            self._users[id(current)] = self._users.get(id(current), 0) + 1
+            return current
+
+    def release(self, searcher):
+        """Give back a searcher obtained from acquire()"""
+        with self._lock:
+            key = id(searcher)
+            self._users[key] -= 1
+            if self._users[key] == 0:
+                del self._users[key]
+                retired = self._retired.pop(key, None)
+                if retired is not None:
+                    retired.close()
+
+    @contextmanager
+    def searcher(self):
+        """Borrow the shared searcher for the duration of a with block"""
+        searcher = self.acquire()
+        try:
+            yield searcher
+        finally:
+            self.release(searcher)
+
+searcher_manager = SearcherManager()
 
 def get_indexed_files():
-    """Get set of filenames that are already indexed"""
-    ix = init_index()
-    with ix.searcher() as searcher:
-        # Get unique filenames from the index
-        return {doc['filename'] for doc in searcher.all_stored_fields()}
+    """Get set of filenames that are already indexed.
+
+    Reads the terms of the `path` ID field, one per book, instead of loading
+    the stored fields (including the full page text) of every page, so the
+    cost depends on the number of books rather than the number of pages.
+    """
+    filenames = set()
+    for shard in range(INDEX_SHARDS):
+        with init_index(shard).searcher() as searcher:
+            reader = searcher.reader()
+            paths = reader.field_terms('path')
+            if reader.has_deletions():
+                # Terms of deleted books stay in the lexicon until their segment is merged
+                paths = (p for p in paths if searcher.document_number(path=p) is not None)
+            filenames.update(Path(p).name for p in paths)
+    return filenames
+
+# The manifest records size, mtime and content hash of every indexed book so
+# indexing runs can add, update or delete only the books that actually changed.
+MANIFEST_PATH = Path(INDEX_DIR) / 'manifest.json'
+
+def load_manifest(data_dir=Path('data')):
+    """Return {filename: {"path", "size", "mtime", "hash", "title", "search_title",
+    "page_count"}} for every indexed book.
+
+    Indexes built before the manifest existed are bootstrapped from the
+    filenames in the index with the files' current size and mtime and no
+    hash, so those books are only re-indexed once they change on disk.
+    """
+    if MANIFEST_PATH.exists():
+        with open(MANIFEST_PATH, 'r') as f:
+            return json.load(f)['books']
+    books = {}
+    for filename in get_indexed_files():
+        pdf_path = data_dir / filename
+        books[filename] = {"path": str(pdf_path), "size": None, "mtime": None, "hash": None}
+        if pdf_path.exists():
+            stat = pdf_path.stat()
+            books[filename].update(size=stat.st_size, mtime=stat.st_mtime)
+    save_manifest(books)
+    return books
+
+def save_manifest(books):
+    """Atomically replace the manifest so a crash never leaves it half-written"""
+    MANIFEST_PATH.parent.mkdir(exist_ok=True)
+    tmp_path = MANIFEST_PATH.with_suffix('.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump({"version": 1, "books": books}, f, indent=1)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+# In-memory copy of the manifest for request handlers, reloaded whenever the
+# file changes (also when another process, e.g. regenerate_index.py, wrote it)
+_book_metadata = {}
+_book_metadata_mtime = None
+_book_metadata_lock = threading.Lock()
+
+def get_book_metadata(filename):
+    """Manifest entry of one book (path, size, mtime, hash, title, search_title, page_count) or None"""
+    global _book_metadata, _book_metadata_mtime
+    try:
+        mtime = MANIFEST_PATH.stat().st_mtime_ns
+    except OSError:
+        return None
+    with _book_metadata_lock:
+        if mtime != _book_metadata_mtime:
+            try:
+                with open(MANIFEST_PATH, 'r') as f:
+                    _book_metadata = json.load(f)['books']
+                _book_metadata_mtime = mtime
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning("Could not load book metadata: %s", e)
+        return _book_metadata.get(filename)
+
+def plan_index_update(data_dir, manifest):
+    """Compare data_dir with the manifest and return (changed, removed, touched).
+
+    changed lists PDFs that are new or whose content differs from the indexed
+    version, removed the indexed filenames that are gone from disk. Files
+    whose mtime moved but whose content hash is unchanged are not re-indexed;
+    their manifest entry is refreshed in place and their names are returned
+    in touched so the caller knows to save the manifest. Unchanged books
+    indexed before the manifest held titles get their metadata filled in
+    the same way.
+    """
+    changed, touched = [], []
+    on_disk = set()
+    for pdf_path in sorted(data_dir.glob('*.pdf')):
+        on_disk.add(pdf_path.name)
+        entry = manifest.get(pdf_path.name)
+        if entry is None:
+            changed.append(pdf_path)
+            continue
+        stat = pdf_path.stat()
+        if entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+            pass
+        elif (entry['hash'] is not None and entry['size'] == stat.st_size
+                and file_hash(pdf_path) == entry['hash']):
+            entry['mtime'] = stat.st_mtime
+            touched.append(pdf_path.name)
+        else:
+            changed.append(pdf_path)
+            continue
+        if 'title' not in entry:
+            entry.update(read_book_metadata(pdf_path))
+            if pdf_path.name not in touched:
+                touched.append(pdf_path.name)
+    removed = set(manifest) - on_disk
+    return changed, removed, touched
+
+# Number of worker processes used to extract PDF text while indexing.
+# The main process is the single index writer and consumes their output.
+# Indexing runs on a thread of the threaded server, so the workers are
+# spawned, not forked (see _pdfium_lock).
+EXTRACT_WORKERS = os.cpu_count() or 1
+
+# Extracted page text is kept in a SQLite sidecar keyed by the PDF's content
+# hash (and the extraction backends, see text_cache_key()), so re-indexing
+# (e.g. after a schema or analyzer change) does not have to extract the text
+# again. It lives outside index/ so rebuild_index.py keeps it.
+TEXT_CACHE_PATH = Path('cache') / 'page_text.sqlite3'
+
+def file_hash(path, chunk_size=1024 * 1024):
+    """SHA-1 of a file's content, read in chunks"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def open_text_cache(path=None):
+    """Open (creating if needed) the extracted-text cache database, TEXT_CACHE_PATH by default"""
+    path = Path(path or TEXT_CACHE_PATH)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(path), timeout=30)
+    # WAL lets the extraction workers read while the index writer stores new books
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS books (
+            file_hash TEXT PRIMARY KEY
+        );
+        CREATE TABLE IF NOT EXISTS pages (
+            file_hash TEXT NOT NULL,
+            page_num INTEGER NOT NULL,
+            text BLOB NOT NULL,
+            PRIMARY KEY (file_hash, page_num)
+        );
+    """)
+    return conn
+
+def get_cached_pages(conn, digest):
+    """Return the cached (page_num, text) list for a file hash, or None on a miss"""
+    if conn.execute('SELECT 1 FROM books WHERE file_hash = ?', (digest,)).fetchone() is None:
+        return None
+    rows = conn.execute(
+        'SELECT page_num, text FROM pages WHERE file_hash = ? ORDER BY page_num', (digest,))
+    return [(page_num, zlib.decompress(text).decode('utf-8')) for page_num, text in rows]
+
+def put_cached_pages(conn, digest, pages, start=True, complete=True):
+    """Store the extracted pages of a book, zlib-compressed, under its file hash.
+
+    A book extracted in chunks is stored chunk by chunk: start drops pages
+    stored earlier and is only set for the first chunk, complete marks the
+    book as cached and is only set for the last one.
+    """
+    with conn:
+        if start:
+            conn.execute('DELETE FROM pages WHERE file_hash = ?', (digest,))
+        conn.executemany(
+            'INSERT OR REPLACE INTO pages (file_hash, page_num, text) VALUES (?, ?, ?)',
+            ((digest, page_num, zlib.compress(text.encode('utf-8'))) for page_num, text in pages))
+        if complete:
+            # A books row marks the book as complete; pages without text have no row
+            conn.execute('INSERT OR REPLACE INTO books (file_hash) VALUES (?)', (digest,))
+
+# pdfium is not thread-safe, so all calls into it are serialized (extraction
+# runs in the server process when a single book is indexed, next to /pdf_page).
+# Request threads hold this lock at any time, so the server must never fork
+# a process that uses pdfium: the child would get the lock held by a thread
+# that does not exist there and wait for it forever. Worker pools are spawned.
+_pdfium_lock = threading.Lock()
+
+class PdfiumExtractor:
+    """Page text from pdfium's text layer; fast, the default backend"""
+
+    def __init__(self, pdf_path):
+        with _pdfium_lock:
+            self.pdf = pdfium.PdfDocument(str(pdf_path))
+            self.page_count = len(self.pdf)
+
+    def page_text(self, index):
+        with _pdfium_lock:
+            page = self.pdf[index]
+            try:
+                textpage = page.get_textpage()
+                try:
+                    text = textpage.get_text_range()
+                finally:
+                    textpage.close()
+            finally:
+                page.close()
+        # pdfium ends lines with \r\n and marks hyphens it considers soft with \x02
+        return text.replace('\r\n', '\n').replace('\r', '\n').replace('\x02', '-')
+
+    def close(self):
+        with _pdfium_lock:
+            self.pdf.close()
+
+class PdfplumberExtractor:
+    """Page text from pdfplumber (pdfminer); slow, but reads some PDFs pdfium garbles"""
+
+    def __init__(self, pdf_path):
+        self.pdf = pdfplumber.open(pdf_path)
+        self.page_count = len(self.pdf.pages)
+
+    def page_text(self, index):
+        page = self.pdf.pages[index]
+        try:
+            return page.extract_text() or ''
+        finally:
+            # Drop the page's parsed objects and layout, which pdfplumber keeps otherwise
+            getattr(page, 'close', page.flush_cache)()
+
+    def close(self):
+        self.pdf.close()
+
+# Text extraction backends by id. EXTRACT_BACKEND reads every page; a page it
+# returns empty or garbled text for is read again with EXTRACT_FALLBACK_BACKEND
+# (None for no fallback). Extracted text is cached per backend combination.
+EXTRACTORS = {'pdfium': PdfiumExtractor, 'pdfplumber': PdfplumberExtractor}
+EXTRACT_BACKEND = 'pdfium'
+EXTRACT_FALLBACK_BACKEND = 'pdfplumber'
+
+def extractor_id(settings=None):
+    """Id of the configured backends (or those of settings), such as pdfium+pdfplumber"""
+    settings = settings or extract_settings()
+    return '+'.join(b for b in (settings.backend, settings.fallback_backend) if b)
+
+def text_cache_key(digest, settings=None):
+    """Text cache key of a PDF with this content hash under the configured backends.
+
+    Caches written before there were several backends hold pdfplumber text
+    under the bare hash, which is still the key of pdfplumber alone.
+    """
+    backends = extractor_id(settings)
+    return digest if backends == 'pdfplumber' else f"{digest}:{backends}"
+
+def text_looks_garbled(text):
+    """Whether extracted text is mostly unreadable (missing ToUnicode maps, broken fonts)"""
+    chars = [c for c in text if not c.isspace()]
+    if not chars:
+        return False
+    bad = sum(1 for c in chars if c == '\ufffd' or unicodedata.category(c) in ('Cc', 'Co', 'Cn', 'Cs'))
+    letters = sum(1 for c in chars if c.isalpha())
+    return bad > len(chars) * 0.05 or (len(chars) >= 40 and letters < len(chars) * 0.2)
+
+# Books longer than this many pages are extracted in chunks of this size,
+# each a separate task that opens the PDF, reads its pages one at a time and
+# closes it again, so memory does not grow with the length of a book. Chunks
+# are passed on to the index writer in page order as they complete.
+EXTRACT_CHUNK_PAGES = 100
+# Resident memory (MB) of an extraction process above which the PDF being
+# read is closed and reopened to drop the parsers' caches; checked after
+# every page where /proc is available (Linux). None turns the check off.
+EXTRACT_MEMORY_LIMIT_MB = 1024
+
+# The extraction settings above, as read by the process that starts an
+# indexing run. The extraction workers are spawned and import this module
+# afresh, so they would only see its defaults, not settings changed at
+# runtime (by benchmark.py, the tests or an embedding script); every task
+# gets them as an argument instead.
+ExtractSettings = namedtuple('ExtractSettings', 'backend fallback_backend memory_limit_mb cache_path chunk_pages')
+
+def extract_settings():
+    """The current extraction settings of this process"""
+    return ExtractSettings(EXTRACT_BACKEND, EXTRACT_FALLBACK_BACKEND, EXTRACT_MEMORY_LIMIT_MB,
+                           TEXT_CACHE_PATH, EXTRACT_CHUNK_PAGES)
+
+def process_rss_mb():
+    """Resident memory of this process in MB, or None where /proc is not available"""
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return resident_pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+def pdf_page_count(pdf_path):
+    with _pdfium_lock:
+        pdf = pdfium.PdfDocument(str(pdf_path))
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+
+def extract_pdf_pages(pdf_path, page_seconds=None, first=0, last=None, settings=None):
+    """Extract (page_num, text) for every page with content, or for pages first..last-1 (0-based).
+
+    Uses EXTRACT_BACKEND, falling back to EXTRACT_FALLBACK_BACKEND page by
+    page. If page_seconds is given, the time taken by each page is appended
+    to page_seconds[backend id] for each backend that read it. Page state is
+    released after every page, and the PDF is reopened when this process
+    grows past EXTRACT_MEMORY_LIMIT_MB. settings (an ExtractSettings)
+    overrides these settings.
+    """
+    settings = settings or extract_settings()
+    backend, fallback_backend = settings.backend, settings.fallback_backend
+    pages = []
+    extractor = EXTRACTORS[backend](pdf_path)
+    fallback = None
+    memory_limit = settings.memory_limit_mb
+    try:
+        last = extractor.page_count if last is None else min(last, extractor.page_count)
+        for index in range(first, last):
+            start = time.perf_counter()
+            text = extractor.page_text(index)
+            if page_seconds is not None:
+                page_seconds.setdefault(backend, []).append(time.perf_counter() - start)
+            if fallback_backend and (not text.strip() or text_looks_garbled(text)):
+                start = time.perf_counter()
+                if fallback is None:
+                    fallback = EXTRACTORS[fallback_backend](pdf_path)
+                text = fallback.page_text(index) or text
+                if page_seconds is not None:
+                    page_seconds.setdefault(fallback_backend, []).append(time.perf_counter() - start)
+            if text.strip():  # Only index pages with content
+                pages.append((index + 1, text))
+
+            rss = process_rss_mb() if memory_limit else None
+            if rss is not None and rss > memory_limit and index + 1 < last:
+                logger.info("Extraction process at %d MB after page %d of %s, reopening it",
+                            rss, index + 1, pdf_path.name)
+                extractor.close()
+                extractor = EXTRACTORS[backend](pdf_path)
+                if fallback is not None:
+                    fallback.close()
+                    fallback = None
+                gc.collect()
+                # If reopening did not help (the memory is not the PDF's), don't
+                # reopen after every page; wait until it has grown some more
+                memory_limit = max(memory_limit, (process_rss_mb() or 0) * 1.25)
+    finally:
+        extractor.close()
+        if fallback is not None:
+            fallback.close()
+    return pages
+
+# Result of extract_book(). pages is None for a book longer than
+# EXTRACT_CHUNK_PAGES whose text is not cached; it is extracted in chunks by
+# extract_page_range() then. timings is {"seconds": total, "page_seconds":
+# {backend: [per page]}}.
+ExtractedBook = namedtuple('ExtractedBook', 'digest pages from_cache metadata timings page_count')
+
+def extract_book(pdf_path, settings=None):
+    """Return the ExtractedBook for one PDF.
+
+    metadata is the read_book_metadata() dict, stored in the manifest.
+    settings defaults to extract_settings(); extract_books() passes the
+    settings of its own process, which spawned workers would not see otherwise.
+
+    Runs inside an extraction worker process, so it must stay a plain
+    top-level function that only takes and returns picklable values. Cache
+    misses are stored by the writer process, never by the workers.
+    """
+    settings = settings or extract_settings()
+    start = time.perf_counter()
+    digest = file_hash(pdf_path)
+    try:
+        conn = open_text_cache(settings.cache_path)
+        try:
+            pages = get_cached_pages(conn, text_cache_key(digest, settings))
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.warning("Text cache unavailable, extracting %s: %s", pdf_path.name, e)
+        pages = None
+    metadata = read_book_metadata(pdf_path)
+    page_seconds = {}
+    from_cache = pages is not None
+    page_count = len(pages) if from_cache else pdf_page_count(pdf_path)
+    if not from_cache and page_count <= settings.chunk_pages:
+        pages = extract_pdf_pages(pdf_path, page_seconds, settings=settings)
+    timings = {"seconds": time.perf_counter() - start, "page_seconds": page_seconds}
+    return ExtractedBook(digest, pages, from_cache, metadata, timings, page_count)
+
+def extract_page_range(pdf_path, first, last, settings=None):
+    """Return (pages, timings) for pages first..last-1 (0-based) of a PDF; runs in a worker like extract_book()"""
+    start = time.perf_counter()
+    page_seconds = {}
+    pages = extract_pdf_pages(pdf_path, page_seconds, first, last, settings)
+    return pages, {"seconds": time.perf_counter() - start, "page_seconds": page_seconds}
+
+def page_chunks(book, settings=None):
+    """(first, last) page ranges of the chunks of a book extracted in chunks"""
+    chunk_pages = (settings or extract_settings()).chunk_pages
+    return [(first, min(first + chunk_pages, book.page_count))
+            for first in range(0, book.page_count, chunk_pages)]
+
+def extract_books(pdf_files, workers=None, settings=None):
+    """Extract PDFs in a process pool, yielding (pdf_path, kind, payload) events.
+
+    Every book starts with ("book", ExtractedBook). If its pages are None,
+    one ("pages", (pages, timings)) event per chunk follows, in page order,
+    and then ("done", None). ("error", exception) replaces whatever events
+    of a book are still due. Events of different books interleave, and books
+    finish in the order they complete, not the order given, but only one
+    book at a time is delivered in chunks: a long book that is ready while
+    another one is still open waits until that one is done or failed, so the
+    writer gets to commit between them (see index_pdfs()). Only a bounded
+    number of tasks is in flight at once, the chunks of books already
+    started first, so extracted text does not pile up in memory faster than
+    the writer can consume it. Every task is passed settings (by default
+    extract_settings() at the start of the run).
+    """
+    workers = workers or EXTRACT_WORKERS
+    settings = settings or extract_settings()
+    pdf_files = list(pdf_files)
+    if workers <= 1 or len(pdf_files) <= 1:
+        for pdf_path in pdf_files:
+            try:
+                book = extract_book(pdf_path, settings)
+                yield pdf_path, 'book', book
+                if book.pages is None:
+                    for first, last in page_chunks(book, settings):
+                        yield pdf_path, 'pages', extract_page_range(pdf_path, first, last, settings)
+                    yield pdf_path, 'done', None
+            except Exception as e:
+                yield pdf_path, 'error', e
+        return
+
+    pool = ProcessPoolExecutor(max_workers=min(workers, len(pdf_files)),
+                               mp_context=multiprocessing.get_context('spawn'))
+    try:
+        remaining = iter(pdf_files)
+        ready = deque()  # (pdf_path, chunk number, first, last) waiting for a free slot
+        pending = {}  # future -> (pdf_path, chunk number, or None for extract_book)
+        chunked = {}  # pdf_path -> {"next": chunk to yield next, "count": chunks, "results": {number: result}}
+        waiting = deque()  # (pdf_path, ExtractedBook) of long books to be chunked once chunked is empty
+
+        def submit_tasks():
+            while len(pending) < workers * 2:
+                if ready:
+                    pdf_path, number, first, last = ready.popleft()
+                    pending[pool.submit(extract_page_range, pdf_path, first, last, settings)] = (pdf_path, number)
+                    continue
+                pdf_path = next(remaining, None)
+                if pdf_path is None:
+                    return
+                pending[pool.submit(extract_book, pdf_path, settings)] = (pdf_path, None)
+
+        submit_tasks()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pdf_path, number = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    if number is None or chunked.pop(pdf_path, None) is not None:
+                        # Forget the book's other chunks; their results are ignored
+                        others = [task for task in ready if task[0] != pdf_path]
+                        ready.clear()
+                        ready.extend(others)
+                        yield pdf_path, 'error', e
+                    continue
+                if number is None:
+                    if result.pages is None:
+                        waiting.append((pdf_path, result))
+                    else:
+                        yield pdf_path, 'book', result
+                    continue
+                state = chunked.get(pdf_path)
+                if state is None:
+                    continue  # the book failed already
+                state["results"][number] = result
+                while state["next"] in state["results"]:
+                    yield pdf_path, 'pages', state["results"].pop(state["next"])
+                    state["next"] += 1
+                if state["next"] == state["count"]:
+                    del chunked[pdf_path]
+                    yield pdf_path, 'done', None
+            if waiting and not chunked:
+                pdf_path, book = waiting.popleft()
+                yield pdf_path, 'book', book
+                chunks = page_chunks(book, settings)
+                chunked[pdf_path] = {"next": 0, "count": len(chunks), "results": {}}
+                ready.extend((pdf_path, n, first, last) for n, (first, last) in enumerate(chunks))
+            submit_tasks()
+    finally:
+        # Also reached when the consumer stops early (e.g. client disconnected)
+        pool.shutdown(wait=True, cancel_futures=True)
+
+def store_cached_pages(digest, pages, conn=None, start=True, complete=True, settings=None):
+    """Write freshly extracted pages to the text cache; failures only cost a re-extraction later.
+
+    digest is the file hash; the pages are stored under its text_cache_key()
+    for settings (the current extract_settings() by default). start and
+    complete are passed on to put_cached_pages().
+    """
+    settings = settings or extract_settings()
+    digest = text_cache_key(digest, settings)
+    try:
+        if conn is not None:
+            put_cached_pages(conn, digest, pages, start, complete)
+            return
+        conn = open_text_cache(settings.cache_path)
+        try:
+            put_cached_pages(conn, digest, pages, start, complete)
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.warning("Could not store extracted text in cache: %s", e)
+
+def page_break_span(text, next_text):
+    """Return (content_span, span_split) for the break between a page and the next one"""
+    tail = ' '.join(text.split()[-PAGE_OVERLAP_WORDS:])
+    head = ' '.join(next_text.split()[:PAGE_OVERLAP_WORDS])
+    split = sum(1 for _ in schema['content_span'].process_text(tail))
+    return tail + '\n' + head, split
+
+def add_pdf_pages(writer, pdf_path, pages, next_text=None):
+    """Add the extracted pages of one PDF to an open index writer.
+
+    When the pages are only part of a book, next_text is the text of the
+    page following the last of them.
+    """
+    for i, (page_num, text) in enumerate(pages):
+        span = {}
+        following = pages[i + 1][1] if i + 1 < len(pages) else next_text
+        if PAGE_OVERLAP_WORDS and following is not None:
+            # A phrase across the break is attributed to the page it starts on
+            span['content_span'], span['span_split'] = page_break_span(text, following)
+        writer.add_document(
+            path=str(pdf_path),
+            filename=pdf_path.name,
+            page_num=page_num,
+            content=text,
+            content_case=text,  # Same text, indexed for case-sensitive search
+            page_text=compress_page_text(text),
+            **span
+        )
 
 def index_pdf(pdf_path):
-    """Extract text from PDF and add to search index"""
-    ix = init_index()
-    writer = ix.writer()
-
-    with pdfplumber.open(pdf_path) as pdf:
-        for page_num, page in enumerate(pdf.pages, 1):
-            text = page.extract_text()
-            if text:  # Only index pages with content
-                writer.add_document(
-                    path=str(pdf_path),
-                    filename=pdf_path.name,
-                    page_num=page_num,
-                    content=text,
-                    content_case=text  # Store same text for case-sensitive search
-                )
-    writer.commit()
+    """Extract text from PDF and add to search index, replacing any older version.
+
+    Raises IndexLockedError if an indexing job is running.
+    """
+    with index_writer_lock():
+        for update in index_pdfs([pdf_path], workers=1):
+            if 'error' in update:
+                raise RuntimeError(update['error'])
+
+# Bulk indexing keeps one writer open for a whole run and commits every
+# INDEX_COMMIT_BATCH books without merging; segments are merged once at the end.
+INDEX_COMMIT_BATCH = 50
+# Memory (MB) the index writer may use to buffer postings before spilling to disk
+INDEX_WRITER_LIMITMB = 256
+
+def index_pdfs(pdf_files, workers=None, commit_batch=None, optimize=False):
+    """Index several PDFs, extracting in parallel and writing from this process.
+
+    Yields one progress dict per book as soon as it has been added:
+    {"filename", "current", "total", "pages", "cached", "seconds",
+    "backends"} plus "error" if it failed; seconds is the time taken to get
+    the book's text and backends maps each extraction backend used to
+    {"pages", "seconds"} it read. Books found in the text cache skip
+    extraction entirely. Extraction and writing times also go to the
+    /metrics histograms.
+    Any documents already indexed for a book are replaced, and the manifest
+    is updated after every commit, so it always describes what is durably in
+    the index. Books are committed in batches of commit_batch; the final commit merges
+    the small segments the batches produced, or rewrites the index into a
+    single segment when optimize is True (useful after a full rebuild).
+    With several shards, each book goes to its book_shard() and every shard
+    that received books gets its own writer.
+    Long books are written chunk by chunk as extract_books() delivers them,
+    so only a chunk of a book's text is held at a time. A book is only added
+    to the manifest once all of its chunks are in; if it fails halfway, the
+    pages already written are removed again at the end of the run.
+    """
+    pdf_files = list(pdf_files)
+    total = len(pdf_files)
+    commit_batch = commit_batch or INDEX_COMMIT_BATCH
+    if not index_is_current():
+        raise RuntimeError("The index was built with an older schema; run rebuild_index.py")
+    # Read once, so the workers and the text cache writes below agree on them
+    settings = extract_settings()
+    cache_conn = None
+    try:
+        cache_conn = open_text_cache(settings.cache_path)
+    except sqlite3.Error as e:
+        logger.warning("Text cache unavailable, extracted text will not be cached: %s", e)
+    manifest = load_manifest()
+    batch_entries = {}
+    writers = {}  # shard -> open writer
+    touched_shards = set()
+    chunked = {}  # pdf_path -> state of a book whose chunks are still being added
+    failed_paths = set()  # books that failed after some of their pages were added
+
+    def commit_batch_to_index():
+        start = time.perf_counter()
+        for writer in writers.values():
+            writer.commit(merge=False)
+        writers.clear()
+        index_stage_seconds.observe(time.perf_counter() - start, stage='commit')
+        clear_search_cache()
+        manifest.update(batch_entries)
+        save_manifest(manifest)
+        batch_entries.clear()
+
+    def shard_writer(pdf_path):
+        shard = book_shard(pdf_path.name)
+        writer = writers.get(shard)
+        if writer is None:
+            writer = writers[shard] = init_index(shard).writer(limitmb=INDEX_WRITER_LIMITMB)
+            touched_shards.add(shard)
+        return writer
+
+    def observe_extraction(update, timings):
+        backends = update.setdefault("backends", {})
+        for backend, page_seconds in timings["page_seconds"].items():
+            for seconds in page_seconds:
+                extract_page_seconds.observe(seconds, backend=backend)
+            totals = backends.setdefault(backend, {"pages": 0, "seconds": 0})
+            totals["pages"] += len(page_seconds)
+            totals["seconds"] += sum(page_seconds)
+
+    def add_manifest_entry(pdf_path, book):
+        stat = pdf_path.stat()
+        batch_entries[pdf_path.name] = {
+            "path": str(pdf_path),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "hash": book.digest,
+            **book.metadata
+        }
+        # A commit while a long book is half written would split its pages
+        # across segments, and merging those can put them out of page order
+        # (see find_page_docnums()); it would also make the half book
+        # searchable. The batch is committed once no such book is open;
+        # extract_books() opens one at a time, so that is after each of them.
+        if len(batch_entries) >= commit_batch and not chunked:
+            commit_batch_to_index()
+
+    def remove_partial_books():
+        # Pages written by the same writer can't be deleted before they are
+        # committed, so half-indexed books are removed with fresh writers
+        by_shard = {}
+        for pdf_path in failed_paths:
+            by_shard.setdefault(book_shard(pdf_path.name), []).append(pdf_path)
+        for shard, paths in by_shard.items():
+            writer = init_index(shard).writer()
+            for pdf_path in paths:
+                writer.delete_by_term('path', str(pdf_path))
+            writer.commit(merge=False)
+        failed_paths.clear()
+
+    current = 0
+    try:
+        for pdf_path, kind, payload in extract_books(pdf_files, workers, settings):
+            state = chunked.get(pdf_path)
+            if kind != 'book' and kind != 'error' and state is None:
+                continue  # the rest of a book that failed already
+            error = payload if kind == 'error' else None
+            try:
+                if kind == 'book':
+                    book = payload
+                    update = {"filename": pdf_path.name, "pages": 0, "cached": book.from_cache,
+                              "seconds": round(book.timings["seconds"], 3)}
+                    count_cache_lookup('text', book.from_cache)
+                    if book.pages is not None:
+                        extract_book_seconds.observe(book.timings["seconds"], source='cache' if book.from_cache else 'pdf')
+                    observe_extraction(update, book.timings)
+                    start = time.perf_counter()
+                    shard_writer(pdf_path).delete_by_term('path', str(pdf_path))
+                    if book.pages is None:
+                        # Pages follow chunk by chunk; the last page added so
+                        # far is held back until the page after it is known
+                        chunked[pdf_path] = {"book": book, "update": update, "held": None,
+                                             "seconds": book.timings["seconds"], "cached": False}
+                        manifest.pop(pdf_path.name, None)
+                        continue
+                    if not book.from_cache and cache_conn is not None:
+                        store_cached_pages(book.digest, book.pages, cache_conn, settings=settings)
+                    add_pdf_pages(shard_writer(pdf_path), pdf_path, book.pages)
+                    index_stage_seconds.observe(time.perf_counter() - start, stage='write')
+                    indexed_pages.inc(len(book.pages))
+                    update["pages"] = len(book.pages)
+                    add_manifest_entry(pdf_path, book)
+                elif kind == 'pages':
+                    pages, timings = payload
+                    book, update = state["book"], state["update"]
+                    state["seconds"] += timings["seconds"]
+                    observe_extraction(update, timings)
+                    if cache_conn is not None:
+                        store_cached_pages(book.digest, pages, cache_conn, start=not state["cached"],
+                                           complete=False, settings=settings)
+                        state["cached"] = True
+                    pages = ([state["held"]] if state["held"] else []) + pages
+                    if pages:
+                        start = time.perf_counter()
+                        add_pdf_pages(shard_writer(pdf_path), pdf_path, pages[:-1], next_text=pages[-1][1])
+                        index_stage_seconds.observe(time.perf_counter() - start, stage='write')
+                        indexed_pages.inc(len(pages) - 1)
+                        update["pages"] += len(pages) - 1
+                        state["held"] = pages[-1]
+                    continue
+                elif kind == 'done':
+                    del chunked[pdf_path]
+                    book, update = state["book"], state["update"]
+                    update["seconds"] = round(state["seconds"], 3)
+                    extract_book_seconds.observe(state["seconds"], source='pdf')
+                    if cache_conn is not None:
+                        store_cached_pages(book.digest, [], cache_conn, start=not state["cached"],
+                                           complete=True, settings=settings)
+                    if state["held"]:
+                        add_pdf_pages(shard_writer(pdf_path), pdf_path, [state["held"]])
+                        indexed_pages.inc()
+                        update["pages"] += 1
+                    add_manifest_entry(pdf_path, book)
+            except Exception as e:
+                error = e
+            if error is not None:
+                if chunked.pop(pdf_path, None) is not None:
+                    failed_paths.add(pdf_path)
+                    update = state["update"]
+                elif kind != 'book':
+                    update = {"filename": pdf_path.name, "pages": 0, "cached": False}
+                update["error"] = str(error)
+            current += 1
+            yield {"current": current, "total": total, **update}
+    finally:
+        # Also runs when the consumer stops early, so books that were already
+        # extracted and added are not thrown away
+        failed_paths.update(chunked)
+        for pdf_path in chunked:
+            manifest.pop(pdf_path.name, None)
+        if writers:
+            commit_batch_to_index()
+        if failed_paths:
+            remove_partial_books()
+        if cache_conn is not None:
+            cache_conn.close()
+    for shard in sorted(touched_shards):
+        start = time.perf_counter()
+        ix = init_index(shard)
+        if optimize:
+            ix.optimize()
+        else:
+            ix.writer().commit()  # one merge pass over the segments written above
+        index_stage_seconds.observe(time.perf_counter() - start, stage='optimize' if optimize else 'merge')
+    clear_search_cache()
 
 def clean_index(data_dir):
     """Remove index entries for books that no longer exist in the data directory"""
-    ix = init_index()
+    manifest = load_manifest(data_dir)
     existing_files = set(f.name for f in data_dir.glob('*.pdf'))
-    indexed_files = get_indexed_files()
-    removed_files = indexed_files - existing_files
+    removed_files = set(manifest) - existing_files
     
     if removed_files:
-        writer = ix.writer()
+        by_shard = {}
         for filename in removed_files:
-            # Delete all documents with this path (using the ID field from our schema)
-            writer.delete_by_term('path', str(data_dir / filename))
-        writer.commit()
-        
-        # Verify deletion
-        with ix.searcher() as searcher:
-            remaining = {doc['filename'] for doc in searcher.all_stored_fields()}
-            if any(f in remaining for f in removed_files):
-                print(f"Warning: Some files were not properly removed from the index: {removed_files & remaining}")
+            by_shard.setdefault(book_shard(filename), []).append(filename)
+        remaining = set()
+        for shard, filenames in by_shard.items():
+            ix = init_index(shard)
+            writer = ix.writer()
+            for filename in filenames:
+                # Delete all documents with this path (using the ID field from our schema)
+                writer.delete_by_term('path', manifest[filename]['path'])
+            writer.commit()
+
+            # Verify deletion
+            with ix.searcher() as searcher:
+                remaining.update(f for f in filenames
+                                 if searcher.document_number(path=manifest[f]['path']) is not None)
+        clear_search_cache()
+        if remaining:
+            logger.warning("Some files were not properly removed from the index: %s", remaining)
+
+        for filename in removed_files - remaining:
+            del manifest[filename]
+        save_manifest(manifest)
     
     return removed_files
 
+def highlight_page_end(text, phrases):
+    """Highlight the longest start of a phrase that the page ends with, or return None"""
+    for phrase in phrases:
+        words = phrase.split()
+        for k in range(len(words) - 1, 0, -1):
+            pattern = r'\s+'.join(re.escape(w) for w in words[:k]) + r'\W*$'
+            match = re.search(pattern, text, flags=re.IGNORECASE)
+            if match:
+                start = max(0, match.start() - 200)
+                return f'...{text[start:match.start()]}<b class="match">{text[match.start():].rstrip()}</b>...'
+    return None
+
 def highlight_phrases(text, phrases):
     """Manually highlight phrases in a text snippet."""
     # Create a context window around the first match
@@ -116,7 +1197,8 @@ def highlight_phrases(text, phrases):
             break
     
     if first_match_pos == -1:
-        return text[:200] # Return start of text if no match found
+        # The phrase may start at the end of the page and continue on the next
+        return highlight_page_end(text, phrases) or text[:200]
 
     start = max(0, first_match_pos - 100)
     end = min(len(text), first_match_pos + 100)
@@ -138,9 +1220,24 @@ def highlight_phrases(text, phrases):
 def home():
     return render_template('index.html')
 
+def indexed_content_hash(filename, stat):
+    """The manifest's content hash of a book if the file on disk is still the indexed one"""
+    entry = get_book_metadata(filename)
+    if (entry and entry.get('hash') and entry.get('size') == stat.st_size
+            and entry.get('mtime') == stat.st_mtime):
+        return entry['hash']
+    return None
+
 @app.route('/pdf/<path:filename>/<int:page>')
 def serve_pdf(filename, page):
-    """Serve a PDF file"""
+    """Serve a PDF file with byte-range support.
+
+    Range requests get 206 partial responses, so PDF.js can fetch only the
+    parts of a large book it needs to show the requested page instead of
+    downloading the whole file first. The ETag is the book's content hash
+    from the manifest while the file on disk is the one that was indexed;
+    clients revalidate on every open and get a 304 while it is unchanged.
+    """
     try:
         # Add .pdf extension if not present
         if not filename.lower().endswith('.pdf'):
@@ -149,11 +1246,157 @@ def serve_pdf(filename, page):
         pdf_path = Path('data') / filename
         if not pdf_path.exists():
             return {"error": f"PDF file '{filename}' not found in data directory"}, 404
-        
-        return send_file(pdf_path, mimetype='application/pdf')
+
+        stat = pdf_path.stat()
+        # Werkzeug's default tag (from mtime and size) for books not indexed yet
+        etag = indexed_content_hash(filename, stat) or True
+        # Resolved, because send_file treats relative paths as relative to the app, not the cwd
+        return send_file(pdf_path.resolve(), mimetype='application/pdf', conditional=True,
+                         etag=etag, last_modified=stat.st_mtime)
     except Exception as e:
         return {"error": str(e)}, 500
 
+# Single pages (or short page windows) cut out of a book by /pdf_page, as a
+# standalone PDF or a rendered image. Results are kept on disk; the least
+# recently used files are removed once the cache grows past its size limit.
+PAGE_CACHE_DIR = Path('cache') / 'pages'
+PAGE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+# Most pages one /pdf_page request may return
+PAGE_WINDOW_LIMIT = 10
+PAGE_IMAGE_FORMATS = {'png': 'image/png', 'webp': 'image/webp'}
+
+_page_cache_lock = threading.Lock()
+_page_cache_bytes = None
+
+def extract_page_window(pdf_path, first, count, fmt, scale):
+    """Return the bytes of pages first..first+count-1 (1-based) as a PDF, or page first as an image.
+
+    The window is cut short at the end of the book; IndexError if first is not a page of it.
+    """
+    with _pdfium_lock:
+        pdf = pdfium.PdfDocument(str(pdf_path))
+        try:
+            if not 1 <= first <= len(pdf):
+                raise IndexError(f"Page {first} is out of range (1-{len(pdf)})")
+            count = min(count, len(pdf) - first + 1)
+            buf = io.BytesIO()
+            if fmt == 'pdf':
+                window = pdfium.PdfDocument.new()
+                try:
+                    window.import_pages(pdf, list(range(first - 1, first - 1 + count)))
+                    window.save(buf)
+                finally:
+                    window.close()
+            else:
+                page = pdf[first - 1]
+                try:
+                    image = page.render(scale=scale).to_pil()
+                finally:
+                    page.close()
+                image.save(buf, format=fmt.upper())
+            return buf.getvalue()
+        finally:
+            pdf.close()
+
+def page_cache_entries():
+    """(mtime, size, path) of every page cache file, skipping files removed meanwhile"""
+    entries = []
+    for p in PAGE_CACHE_DIR.iterdir():
+        if p.suffix == '.tmp':
+            continue  # Still being written by another request
+        try:
+            st = p.stat()
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, p))
+    return entries
+
+def store_in_page_cache(cache_path, data):
+    """Write one cache file and evict the least recently used files beyond PAGE_CACHE_MAX_BYTES"""
+    global _page_cache_bytes
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    # Unique per writer, as two requests may miss on the same page at once
+    tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, cache_path)
+    with _page_cache_lock:
+        if _page_cache_bytes is None:
+            _page_cache_bytes = sum(size for _, size, _ in page_cache_entries())
+        else:
+            _page_cache_bytes += len(data)
+        if _page_cache_bytes <= PAGE_CACHE_MAX_BYTES:
+            return
+        # Cache hits bump the mtime, so the oldest mtimes are the least recently used
+        entries = sorted(page_cache_entries())
+        _page_cache_bytes = sum(size for _, size, _ in entries)
+        for _, size, p in entries:
+            if _page_cache_bytes <= PAGE_CACHE_MAX_BYTES or p == cache_path:
+                break
+            try:
+                p.unlink()
+                _page_cache_bytes -= size
+            except OSError:
+                pass
+
+@app.route('/pdf_page/<path:filename>/<int:page>')
+def serve_pdf_page(filename, page):
+    """Serve one page, or a short window of pages, of a book without the rest of it.
+
+    /pdf_page/<filename>/<page>?count=N returns pages page..page+N-1 as a
+    standalone PDF; ?format=png or ?format=webp (with optional &scale=,
+    default 1.5) returns page page rendered as an image instead.
+    """
+    if not filename.lower().endswith('.pdf'):
+        filename = filename + '.pdf'
+    pdf_path = Path('data') / filename
+    if not pdf_path.exists():
+        return jsonify({"error": f"PDF file '{filename}' not found in data directory"}), 404
+
+    fmt = request.args.get('format', 'pdf').lower()
+    if fmt != 'pdf' and fmt not in PAGE_IMAGE_FORMATS:
+        return jsonify({"error": "format must be pdf, png or webp"}), 400
+    try:
+        count = int(request.args.get('count', 1))
+        scale = float(request.args.get('scale', 1.5))
+    except ValueError:
+        return jsonify({"error": "count and scale must be numbers"}), 400
+    if not 1 <= count <= PAGE_WINDOW_LIMIT or not 0 < scale <= 4:
+        return jsonify({"error": f"count must be 1-{PAGE_WINDOW_LIMIT} and scale at most 4"}), 400
+    if fmt != 'pdf':
+        count = 1
+    else:
+        scale = None  # Does not affect the result, keep it out of the cache key
+
+    stat = pdf_path.stat()
+    version = indexed_content_hash(filename, stat) or f"{stat.st_size}-{stat.st_mtime}"
+    key = hashlib.sha1(f"{filename}|{version}|{page}|{count}|{fmt}|{scale}".encode('utf-8')).hexdigest()
+    cache_path = PAGE_CACHE_DIR / f"{key}.{fmt}"
+
+    # Another thread or worker may evict the file at any moment, so it is
+    # read right away and a file that has gone is treated as a miss
+    try:
+        os.utime(cache_path)  # Mark as recently used
+        data = cache_path.read_bytes()
+    except FileNotFoundError:
+        data = None
+    count_cache_lookup('pages', data is not None)
+    if data is None:
+        try:
+            data = extract_page_window(pdf_path.resolve(), page, count, fmt, scale)
+        except IndexError as e:
+            return jsonify({"error": str(e)}), 404
+        except Exception as e:
+            logger.warning("Error extracting page %s of %s: %s", page, filename, e)
+            return jsonify({"error": str(e)}), 500
+        try:
+            store_in_page_cache(cache_path, data)
+        except OSError as e:
+            logger.warning("Could not store page %s of %s in the page cache: %s", page, filename, e)
+
+    mimetype = 'application/pdf' if fmt == 'pdf' else PAGE_IMAGE_FORMATS[fmt]
+    return send_file(io.BytesIO(data), mimetype=mimetype, conditional=True, etag=key)
+
 @app.route('/pdf/title/<path:filename>')
 def get_title(filename):
     """Get the title of a PDF file"""
@@ -173,17 +1416,12 @@ def get_title_for_search(filename):
         pdf_path = Path('data') / filename
         if not pdf_path.exists():
             return jsonify({"error": f"PDF file '{filename}' not found"}), 404
-            
-        title = get_pdf_title(filename)
-        
-        # Strip off any "GA ..." prefix from the title string for search purposes
-        # This removes patterns like "GA 261 - ", "GA_082 - ", etc.
-        cleaned_title = re.sub(r'^\s*GA[_\s-]*\d+[A-Za-z]*\s*-\s*', '', title).strip()
-        
-        # If stripping the prefix results in an empty string, use the original title
-        search_title = cleaned_title if cleaned_title else title
-        
-        return jsonify({"title": search_title, "filename": filename})
+
+        # The "GA ..." prefix was stripped when the book was indexed
+        entry = get_book_metadata(filename)
+        if entry and entry.get('search_title'):
+            return jsonify({"title": entry['search_title'], "filename": filename})
+        return jsonify({"title": search_title(get_pdf_title(filename)), "filename": filename})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -192,61 +1430,388 @@ def serve_pdfjs(filename):
     """Serve PDF.js viewer files"""
     return send_from_directory('static/pdfjs', filename)
 
-@app.route('/index_books')
-def index_books():
-    """Index only new PDFs in the data directory with progress updates"""
-    def generate_updates():
+# Indexing runs as a background job, one at a time, so it keeps going when
+# the browser disconnects and never races another writer for the index
+# lock. The job's state is checkpointed to INDEX_JOB_PATH; a job cut off by
+# a restart is resumed on the next request. Books committed before the
+# interruption are in the manifest and books already extracted are in the
+# text cache, so a resumed job redoes little work.
+INDEX_JOB_PATH = Path(INDEX_DIR) / 'index_job.json'
+# Locked by the process running a job, so that when several server worker
+# processes share the index (see serve.py) only one of them runs a job and
+# the others report it from its checkpoint
+INDEX_JOB_LOCK_PATH = Path(INDEX_DIR) / 'index_job.lock'
+# Finished jobs kept around for their status endpoints
+INDEX_JOB_HISTORY = 20
+
+class IndexJob:
+    """One indexing run: its progress events and current state.
+
+    Events are the dicts /index_books has always streamed ("cleanup",
+    "indexing", "complete" statuses, or "error"); clients read them from
+    any offset and wait for more while the job is running.
+    """
+
+    def __init__(self, resumed_from=None):
+        self.job_id = uuid.uuid4().hex
+        self.resumed_from = resumed_from
+        self.state = 'queued'
+        self.current = 0
+        self.total = 0
+        self.filename = None
+        self.errors = []
+        self.events = []
+        self.started = time.time()
+        self.finished = None
+        self.lock_file = None  # from acquire_index_job_lock(), released when the job ends
+        self._cond = threading.Condition()
+
+    def emit(self, event):
+        with self._cond:
+            self.events.append(event)
+            if event.get('status') == 'indexing':
+                self.current, self.total, self.filename = event['current'], event['total'], event['filename']
+            if 'error' in event:
+                self.errors.append(event['error'])
+            self._cond.notify_all()
+
+    def finish(self, state):
+        with self._cond:
+            self.state = state
+            self.finished = time.time()
+            self._cond.notify_all()
+
+    @property
+    def done(self):
+        return self.state in ('complete', 'failed')
+
+    def wait_for_events(self, since, timeout=None):
+        """Events from offset since on, waiting up to timeout for new ones while the job runs"""
+        with self._cond:
+            if len(self.events) <= since and not self.done:
+                self._cond.wait(timeout)
+            return self.events[since:]
+
+    def status(self):
+        with self._cond:
+            return {
+                "job_id": self.job_id,
+                "state": self.state,
+                "current": self.current,
+                "total": self.total,
+                "filename": self.filename,
+                "errors": list(self.errors),
+                "events": len(self.events),
+                "message": self.events[-1].get('message') if self.events else None,
+                "started": self.started,
+                "finished": self.finished,
+                "resumed_from": self.resumed_from
+            }
+
+_index_jobs = OrderedDict()
+_index_jobs_lock = threading.Lock()
+_index_job_resume_checked = False
+
+def save_index_job(job):
+    """Checkpoint the job's state, atomically like the manifest"""
+    INDEX_JOB_PATH.parent.mkdir(exist_ok=True)
+    tmp_path = INDEX_JOB_PATH.with_suffix('.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(job.status(), f)
+    os.replace(tmp_path, INDEX_JOB_PATH)
+
+class CheckpointedIndexJob:
+    """A job running in another server process, seen through its checkpoint.
+
+    Offers status() and the event interface of IndexJob, with "indexing"
+    events made up from the progress recorded after every book.
+    """
+
+    def __init__(self, checkpoint):
+        self.job_id = checkpoint['job_id']
+        self.checkpoint = checkpoint
+        self.events = []
+        self._seen = None
+
+    def reload(self):
+        checkpoint = load_index_job_checkpoint()
+        if checkpoint is not None and checkpoint.get('job_id') == self.job_id:
+            self.checkpoint = checkpoint
+        if not self.done_in_checkpoint and not index_job_lock_is_held():
+            # The process running it is gone; it will be resumed on the next request
+            self.checkpoint = {**self.checkpoint, "state": "interrupted"}
+
+    @property
+    def done_in_checkpoint(self):
+        return self.checkpoint.get('state') not in ('queued', 'running')
+
+    @property
+    def done(self):
+        return self.done_in_checkpoint
+
+    def status(self):
+        self.reload()
+        return dict(self.checkpoint)
+
+    def wait_for_events(self, since, timeout=None):
+        time.sleep(min(timeout or 1, 1))
+        self.reload()
+        progress = (self.checkpoint.get('current'), self.checkpoint.get('total'))
+        if progress != self._seen and self.checkpoint.get('total'):
+            self._seen = progress
+            self.events.append({"status": "indexing", "current": progress[0], "total": progress[1],
+                                "filename": self.checkpoint.get('filename')})
+        if self.done and not any(e.get('status') == 'complete' or 'error' in e for e in self.events):
+            if self.checkpoint.get('state') == 'complete':
+                self.events.append({"status": "complete", "message": self.checkpoint.get('message')})
+            else:
+                self.events.append({"error": "; ".join(self.checkpoint.get('errors') or [])
+                                    or f"Indexing job {self.checkpoint.get('state')}"})
+        return self.events[since:]
+
+def load_index_job_checkpoint():
+    try:
+        with open(INDEX_JOB_PATH, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def acquire_index_job_lock():
+    """Take the cross-process job lock without waiting; the open lock file, or None if it is held"""
+    INDEX_JOB_LOCK_PATH.parent.mkdir(exist_ok=True)
+    lock_file = open(INDEX_JOB_LOCK_PATH, 'a')
+    if fcntl is None:
+        return lock_file  # Windows is served from a single process
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+def index_job_lock_is_held():
+    lock_file = acquire_index_job_lock()
+    if lock_file is None:
+        return True
+    lock_file.close()
+    return False
+
+class IndexLockedError(RuntimeError):
+    """Another process is writing to the index"""
+
+@contextmanager
+def index_writer_lock():
+    """Hold the job lock for indexing outside a job (scripts, index_pdf()).
+
+    Raises IndexLockedError right away if a job or another script has it,
+    so that only one process ever writes to the index.
+    """
+    lock_file = acquire_index_job_lock()
+    if lock_file is None:
+        raise IndexLockedError("The index is being updated by another process "
+                               "(an indexing job or script); try again when it has finished")
+    try:
+        yield
+    finally:
+        lock_file.close()
+
+def get_index_job(job_id):
+    """A job of this process, or the checkpointed one if it has that id"""
+    with _index_jobs_lock:
+        job = _index_jobs.get(job_id)
+    if job is None:
+        checkpoint = load_index_job_checkpoint()
+        if checkpoint is not None and checkpoint.get('job_id') == job_id:
+            job = CheckpointedIndexJob(checkpoint)
+            job.reload()
+    return job
+
+def start_index_job(resumed_from=None):
+    """Start an indexing job, or return the one already running.
+
+    Returns (job, started) where started is False if a job was running,
+    in this process or (as a CheckpointedIndexJob) in another one. Raises
+    IndexLockedError if another process holds the lock without running a
+    job.
+    """
+    with _index_jobs_lock:
+        for job in _index_jobs.values():
+            if not job.done:
+                return job, False
+        lock_file = acquire_index_job_lock()
+        if lock_file is None:
+            # The other process saves its checkpoint right after taking the lock
+            for _ in range(50):
+                checkpoint = load_index_job_checkpoint()
+                if checkpoint is not None and checkpoint.get('state') in ('queued', 'running'):
+                    return CheckpointedIndexJob(checkpoint), False
+                time.sleep(0.1)
+            # No job there: a script such as rebuild_index.py is indexing
+            raise IndexLockedError("The index is being updated by another process "
+                                   "(e.g. rebuild_index.py); try again when it has finished")
+        job = IndexJob(resumed_from)
+        job.lock_file = lock_file
+        save_index_job(job)
+        _index_jobs[job.job_id] = job
+        while len(_index_jobs) > INDEX_JOB_HISTORY:
+            oldest = next(iter(_index_jobs))
+            if not _index_jobs[oldest].done:
+                break
+            del _index_jobs[oldest]
+    threading.Thread(target=run_index_job, args=(job,), name=f"index-job-{job.job_id[:8]}", daemon=True).start()
+    return job, True
+
+def resume_index_job():
+    """Restart the checkpointed job if the last process stopped while it was running"""
+    global _index_job_resume_checked
+    with _index_jobs_lock:
+        if _index_job_resume_checked:
+            return
+        _index_job_resume_checked = True
+    checkpoint = load_index_job_checkpoint()
+    if checkpoint is None:
+        return
+    if checkpoint.get('state') in ('queued', 'running') and not index_job_lock_is_held():
+        logger.info("Resuming interrupted indexing job %s", checkpoint.get('job_id'))
+        try:
+            start_index_job(resumed_from=checkpoint.get('job_id'))
+        except IndexLockedError as e:
+            logger.warning("Could not resume indexing job: %s", e)
+
+def run_index_job(job):
+    """Body of the job thread: clean up, then index new or changed books"""
+    try:
+        job.state = 'running'
+        save_index_job(job)
         data_dir = Path('data')
         if not data_dir.exists():
-            yield json.dumps({"error": "Data directory not found"}) + "\n"
+            job.emit({"error": "Data directory not found"})
+            job.finish('failed')
+            return
+
+        if not index_is_current():
+            job.emit({"error": "The index was built with an older schema; run rebuild_index.py"})
+            job.finish('failed')
             return
 
         # Clean up index first
         removed_files = clean_index(data_dir)
         if removed_files:
-            yield json.dumps({
+            job.emit({
                 "status": "cleanup",
                 "message": f"Removed {len(removed_files)} deleted book{'s' if len(removed_files) != 1 else ''} from index"
-            }) + "\n"
+            })
 
-        # Get list of all PDF files and already indexed files
-        pdf_files = list(data_dir.glob('*.pdf'))
-        indexed_files = get_indexed_files()
-        
-        # Filter for new files only
-        new_files = [f for f in pdf_files if f.name not in indexed_files]
+        # Only books that are new or whose content changed since they were indexed
+        manifest = load_manifest(data_dir)
+        new_files, _, touched = plan_index_update(data_dir, manifest)
+        if touched:
+            save_manifest(manifest)
         total_files = len(new_files)
 
         if total_files == 0:
-            yield json.dumps({
+            job.emit({
                 "status": "complete",
-                "message": "No new books to index"
-            }) + "\n"
+                "message": "No new or changed books to index"
+            })
+            job.finish('complete')
             return
-        
-        for i, pdf_file in enumerate(new_files, 1):
-            try:
-                yield json.dumps({
-                    "status": "indexing",
-                    "current": i,
-                    "total": total_files,
-                    "filename": pdf_file.name
-                }) + "\n"
-                
-                index_pdf(pdf_file)
-                
-            except Exception as e:
-                yield json.dumps({
-                    "error": f"Error indexing {pdf_file.name}: {str(e)}"
-                }) + "\n"
 
-        yield json.dumps({
+        # Books are reported as the single writer finishes them; extraction of
+        # the following books keeps running in the worker processes meanwhile
+        for update in index_pdfs(new_files):
+            job.emit({
+                "status": "indexing",
+                "current": update["current"],
+                "total": update["total"],
+                "filename": update["filename"]
+            })
+            if "error" in update:
+                job.emit({
+                    "error": f"Error indexing {update['filename']}: {update['error']}"
+                })
+            save_index_job(job)
+
+        job.emit({
             "status": "complete",
-            "message": f"Indexed {total_files} new book{'s' if total_files != 1 else ''}"
-        }) + "\n"
+            "message": f"Indexed {total_files} new or changed book{'s' if total_files != 1 else ''}"
+        })
+        job.finish('complete')
+    except Exception as e:
+        logger.exception("Indexing job %s failed", job.job_id)
+        job.emit({"error": f"Indexing failed: {e}"})
+        job.finish('failed')
+    finally:
+        try:
+            save_index_job(job)
+        except OSError as e:
+            logger.warning("Could not checkpoint indexing job: %s", e)
+        if job.lock_file is not None:
+            job.lock_file.close()
+
+def stream_index_job(job, since=0):
+    """Yield the job's events as NDJSON lines from offset since until it finishes.
+
+    Stopping the stream (client gone) does not affect the job itself.
+    """
+    while True:
+        events = job.wait_for_events(since, timeout=15)
+        for event in events:
+            yield json.dumps(event) + "\n"
+        since += len(events)
+        if job.done and since >= len(job.events):
+            return
+
+@app.before_request
+def resume_interrupted_index_job():
+    if not _index_job_resume_checked:
+        resume_index_job()
 
+@app.route('/index_books')
+def index_books():
+    """Start indexing new or changed PDFs (or attach to the running job) and stream its progress"""
+    try:
+        job, started = start_index_job()
+    except IndexLockedError as e:
+        return jsonify({"error": str(e)}), 409
+    def generate_updates():
+        yield json.dumps({"status": "started" if started else "attached", "job_id": job.job_id}) + "\n"
+        yield from stream_index_job(job)
     return Response(generate_updates(), mimetype='text/event-stream')
 
+@app.route('/index_jobs', methods=['GET', 'POST'])
+def index_jobs():
+    """POST starts an indexing job (or returns the running one); GET lists known jobs"""
+    if request.method == 'POST':
+        try:
+            job, started = start_index_job()
+        except IndexLockedError as e:
+            return jsonify({"error": str(e)}), 409
+        return jsonify({**job.status(), "started_now": started}), 202 if started else 200
+    with _index_jobs_lock:
+        jobs = list(_index_jobs.values())
+    return jsonify([job.status() for job in reversed(jobs)])
+
+@app.route('/index_jobs/<job_id>')
+def index_job_status(job_id):
+    """Current state and progress of one indexing job"""
+    job = get_index_job(job_id)
+    if job is None:
+        return jsonify({"error": f"No indexing job {job_id}"}), 404
+    return jsonify(job.status())
+
+@app.route('/index_jobs/<job_id>/progress')
+def index_job_progress(job_id):
+    """Stream the job's progress events as NDJSON, from ?since=<offset> on, until it finishes"""
+    job = get_index_job(job_id)
+    if job is None:
+        return jsonify({"error": f"No indexing job {job_id}"}), 404
+    try:
+        since = max(0, int(request.args.get('since', 0)))
+    except ValueError:
+        return jsonify({"error": "since must be an integer"}), 400
+    return Response(stream_index_job(job, since), mimetype='text/event-stream')
+
 # Favorites Storage
 FAVORITES_FILE = 'favorites.json'
 
@@ -257,7 +1822,7 @@ def load_favorites():
         with open(FAVORITES_FILE, 'r') as f:
             return json.load(f)
     except Exception as e:
-        print(f"Error loading favorites: {e}")
+        logger.error("Error loading favorites: %s", e)
         return []
 
 def save_favorites(favorites):
@@ -266,7 +1831,7 @@ def save_favorites(favorites):
             json.dump(favorites, f, indent=2)
         return True
     except Exception as e:
-        print(f"Error saving favorites: {e}")
+        logger.error("Error saving favorites: %s", e)
         return False
 
 @app.route('/favorites', methods=['GET'])
@@ -310,316 +1875,1007 @@ def delete_favorite(favorite_id):
 # Add at the top of the file, after the imports
 debugSelectBooks = False  # When True, only search GA_004.pdf
 
-def replace_placeholder_in_query(query_tree, placeholder, replacement):
+# Most content_case terms one case-sensitive wildcard may expand to
+WILDCARD_EXPANSION_LIMIT = 1000
+
+_term_length_index = OrderedDict()
+_term_length_index_lock = threading.Lock()
+
+def case_term_length_index(ixreader):
+    """Map term length -> content_case terms of that length, built once per index version.
+
+    Used for case-sensitive ? patterns that start with a wildcard and so
+    have no literal prefix to narrow the lexicon range with. Keyed by the
+    reader's segment ids, so a new index generation gets a fresh index.
     """
-    Recursively traverse a Whoosh query tree and replace placeholder terms with actual queries.
+    key = tuple(sorted(r.segment().segment_id() for r, _ in ixreader.leaf_readers()))
+    with _term_length_index_lock:
+        buckets = _term_length_index.get(key)
+        if buckets is None:
+            buckets = {}
+            for text in ixreader.field_terms('content_case'):
+                buckets.setdefault(len(text), []).append(text)
+            _term_length_index[key] = buckets
+            # Only the current index version (and one that may still be in use) matter
+            while len(_term_length_index) > 2:
+                _term_length_index.popitem(last=False)
+        return buckets
+
+class CaseSensitiveWildcard(PatternQuery):
+    """Case-sensitive wildcard (* = any word characters, ? = exactly one) on content_case.
+
+    Whoosh's Wildcard/Regex queries walk the whole content_case lexicon
+    through a regex. This only matches the regex against the sorted lexicon
+    range of its literal prefix (so Fest* walks the terms starting with
+    Fest), or, for ? patterns without a prefix, against a term index
+    bucketed by length. At most WILDCARD_EXPANSION_LIMIT terms are used.
     """
-    from whoosh.query import Term, And, Or, Not, Phrase
-    
-    # If this is a Term node and matches our placeholder
-    if isinstance(query_tree, Term):
-        if query_tree.text == placeholder:
-            return replacement
-        return query_tree
-    
-    # If this is a compound query (And, Or, Not), recursively process children
-    if isinstance(query_tree, (And, Or)):
-        new_children = [replace_placeholder_in_query(child, placeholder, replacement) 
-                       for child in query_tree.children()]
-        if isinstance(query_tree, And):
-            return And(new_children)
+
+    SPECIAL_CHARS = frozenset("*?")
+
+    def __unicode__(self):
+        return "%s:%s" % (self.fieldname, self.text)
+
+    __str__ = __unicode__
+
+    def _get_pattern(self):
+        parts = []
+        for char in self.text:
+            if char == '*':
+                parts.append(r'\w*')
+            elif char == '?':
+                parts.append(r'\w')
+            else:
+                parts.append(re.escape(char))
+        return ''.join(parts) + '$'
+
+    def _btexts(self, ixreader):
+        field = ixreader.schema[self.fieldname]
+        to_bytes = field.to_bytes
+        prefix = self._find_prefix(self.text)
+        exp = re.compile(self._get_pattern())
+
+        if prefix:
+            # Every pattern, Fest* included, is matched against the same
+            # anchored regex, so * never covers non-word characters
+            candidates = (field.from_bytes(b) for b in ixreader.expand_prefix(self.fieldname, prefix))
         else:
-            return Or(new_children)
-    
-    if isinstance(query_tree, Not):
-        return Not(replace_placeholder_in_query(query_tree.query, placeholder, replacement))
-    
-    # For other query types, return as-is
-    return query_tree
+            buckets = case_term_length_index(ixreader)
+            fixed_length = len(self.text.replace('*', ''))
+            if '*' in self.text:
+                candidates = (t for length in sorted(buckets) if length >= fixed_length
+                              for t in buckets[length])
+            else:
+                candidates = buckets.get(fixed_length, ())
+
+        count = 0
+        for text in candidates:
+            if exp.match(text):
+                yield to_bytes(text)
+                count += 1
+                if count >= WILDCARD_EXPANSION_LIMIT:
+                    logger.info("Case-sensitive wildcard %s capped at %d terms", self.text, WILDCARD_EXPANSION_LIMIT)
+                    return
+
+class PageBreakSpanMatcher(SpanWrappingMatcher):
+    """Keeps only the spans that start before the span_split of their document and end after it"""
+
+    def __init__(self, child, splits):
+        self._splits = splits
+        super(PageBreakSpanMatcher, self).__init__(child)
+
+    def copy(self):
+        m = self.__class__(self.child.copy(), self._splits)
+        m._spans = self._spans
+        return m
+
+    def _replacement(self, newchild):
+        return self.__class__(newchild, self._splits)
+
+    def _get_spans(self):
+        split = self._splits[self.id()]
+        return [span for span in self.child.spans() if span.start < split <= span.end]
+
+class PageBreakPhrase(Phrase):
+    """Phrase on content_span that only matches where it crosses the page break.
+
+    content_span also holds the start of the next page, so a plain phrase
+    match there could lie entirely on the next page and be attributed to
+    the wrong one; matches within this page are found on content anyway.
+    """
+
+    def matcher(self, searcher, context=None):
+        m = super(PageBreakPhrase, self).matcher(searcher, context)
+        if not m.is_active():
+            return m
+        return PageBreakSpanMatcher(m, searcher.reader().column_reader('span_split'))
+
+# Most compiled queries compile_query() keeps around
+QUERY_CACHE_SIZE = 1024
+
+# A compiled query: the Whoosh query plus what highlighting and snippets need
+CompiledQuery = namedtuple('CompiledQuery', 'q highlight_terms search_type case_sensitive_terms')
+
+# One token of the search syntax: a paren, a "quoted phrase" (+"Phrase" for
+# case-sensitive) or a bare word. An unterminated quote runs to the end.
+_QUERY_TOKEN_RE = re.compile(r'(\()|(\))|(\+?)"([^"]*)"?|([^\s()"]+)')
+_QUERY_OPERATORS = ('AND', 'OR', 'NOT')
+
+def tokenize_query(query):
+    """Split the search syntax into (kind, text) tokens.
+
+    kind is '(', ')', 'AND', 'OR', 'NOT', 'phrase', 'case_phrase' or 'word'.
+    """
+    tokens = []
+    for match in _QUERY_TOKEN_RE.finditer(query):
+        lparen, rparen, plus, phrase, word = match.groups()
+        if lparen:
+            tokens.append(('(', lparen))
+        elif rparen:
+            tokens.append((')', rparen))
+        elif phrase is not None:
+            tokens.append(('case_phrase' if plus else 'phrase', phrase))
+        elif word in _QUERY_OPERATORS:
+            tokens.append((word, word))
+        else:
+            tokens.append(('word', word))
+    return tokens
+
+def _combine(query_class, nodes):
+    nodes = [node for node in nodes if node is not None]
+    if not nodes:
+        return None
+    return nodes[0] if len(nodes) == 1 else query_class(nodes)
+
+class QueryCompiler:
+    """Recursive-descent compiler from the search syntax to a Whoosh query.
+
+    Within a group (the whole query or a parenthesized part):
+        group    := (and_expr | OR | NOT unary)*
+        and_expr := unary (AND unary)*
+        unary    := NOT unary | ( group ) | "phrase" | +"Phrase" | word
+    Adjacent and OR'd terms match any of them. NOT inside a group excludes
+    its operand from whatever the rest of the group matches, so
+    `a b NOT c` is (a OR b) AND NOT c. Words are analyzed like the content
+    field; +Word searches content_case; term* is a prefix query; other
+    * and ? patterns are wildcards (CaseSensitiveWildcard after +).
+    Highlight terms are collected on the way, leaving out negated parts.
+    """
+
+    def __init__(self, query):
+        self.schema = schema
+        self.tokens = tokenize_query(query)
+        self.pos = 0
+        self.negated = 0
+        self.highlight_terms = []
+        self.case_sensitive_terms = []
+        self.search_type = 'terms'
+
+    def compile(self):
+        q = self.group()
+        # Stray closing parens end a group early; compile the rest as well
+        while self.peek() is not None:
+            self.pos += 1
+            q = _combine(Or, [q, self.group()])
+        q = NullQuery if q is None else q.normalize()
+        return CompiledQuery(q, tuple(self.highlight_terms), self.search_type,
+                             tuple(self.case_sensitive_terms))
+
+    def peek(self):
+        return self.tokens[self.pos][0] if self.pos < len(self.tokens) else None
+
+    def group(self):
+        positive, negative = [], []
+        while self.peek() not in (None, ')'):
+            kind = self.peek()
+            if kind in ('OR', 'AND'):
+                # OR only separates; an AND without a left operand is ignored
+                self.pos += 1
+            elif kind == 'NOT':
+                self.pos += 1
+                negative.append(self.negated_unary())
+            else:
+                positive.append(self.and_expr())
+        positive = _combine(Or, positive)
+        negative = _combine(Or, negative)
+        if negative is None:
+            return positive
+        if positive is None:
+            return Not(negative)
+        return AndNot(positive, negative)
+
+    def and_expr(self):
+        nodes = [self.unary()]
+        while self.peek() == 'AND':
+            self.pos += 1
+            if self.peek() in (None, ')', 'OR', 'AND'):
+                break
+            nodes.append(self.unary())
+        return _combine(And, nodes)
+
+    def negated_unary(self):
+        self.negated += 1
+        try:
+            return self.unary()
+        finally:
+            self.negated -= 1
+
+    def unary(self):
+        kind = self.peek()
+        if kind is None or kind in (')', 'OR', 'AND'):
+            return None
+        text = self.tokens[self.pos][1]
+        self.pos += 1
+        if kind == 'NOT':
+            operand = self.negated_unary()
+            return None if operand is None else Not(operand)
+        if kind == '(':
+            node = self.group()
+            if self.peek() == ')':
+                self.pos += 1
+            return node
+        if kind in ('phrase', 'case_phrase'):
+            return self.phrase(text, case_sensitive=(kind == 'case_phrase'))
+        return self.word(text)
+
+    def record(self, highlight_term, case_sensitive=False, phrase=False):
+        if self.negated:
+            return
+        self.highlight_terms.append(highlight_term)
+        if case_sensitive:
+            self.case_sensitive_terms.append(highlight_term)
+        if phrase:
+            self.search_type = 'phrase'
+
+    def analyzed(self, fieldname, text):
+        return list(self.schema[fieldname].process_text(text, mode='query'))
+
+    def phrase(self, text, case_sensitive=False):
+        fieldname = 'content_case' if case_sensitive else 'content'
+        words = self.analyzed(fieldname, text)
+        if not words:
+            return None
+        self.record(text.strip(), case_sensitive=case_sensitive, phrase=True)
+        if len(words) == 1:
+            return Term(fieldname, words[0])
+        if fieldname == 'content' and PAGE_OVERLAP_WORDS:
+            return Or([Phrase(fieldname, words), PageBreakPhrase('content_span', words)])
+        return Phrase(fieldname, words)
+
+    def word(self, text):
+        case_sensitive = text.startswith('+')
+        fieldname = 'content_case' if case_sensitive else 'content'
+        if case_sensitive:
+            text = text[1:]
+        if '*' in text or '?' in text:
+            pattern = re.sub(r'[^\w*?]', '', text)
+            if not pattern.strip('*?'):
+                # A bare * would match every page
+                return None
+            self.record(pattern.rstrip('*'), case_sensitive=case_sensitive)
+            if case_sensitive:
+                return CaseSensitiveWildcard(fieldname, pattern)
+            pattern = pattern.lower()
+            if re.fullmatch(r'\w+\*', pattern):
+                return Prefix(fieldname, pattern[:-1])
+            return Wildcard(fieldname, pattern)
+
+        words = self.analyzed(fieldname, text)
+        if not words:
+            # Stop words and bare punctuation match nothing
+            return None
+        self.record(re.sub(r'^\W+|\W+$', '', text), case_sensitive=case_sensitive)
+        # A word the analyzer splits (e.g. ganz-mensch) matches any of its parts
+        return _combine(Or, [Term(fieldname, word) for word in words])
+
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def compile_query(query):
+    """Compile the search syntax into a CompiledQuery, memoized per query string.
+
+    Compiling only depends on the schema's analyzers, not on the index
+    contents (wildcards are expanded when the query runs), so a compiled
+    query stays valid across index generations.
+    """
+    compiled = QueryCompiler(query).compile()
+    logger.debug("Compiled query %r: %s", query, compiled.q)
+    return compiled
+
+# Books per page in the paginated /search mode (?cursor=...&books=...)
+SEARCH_PAGE_BOOKS = 20
+# Books per batch in the streamed /search mode
+SEARCH_BATCH_SIZE = 10
+# Most pages a single /snippets request may ask for
+SNIPPET_BATCH_LIMIT = 50
+# Seconds a search may spend matching and counting pages; when it runs out
+# the books found so far are returned, flagged "partial" (0 for no limit)
+SEARCH_TIME_BUDGET = 10.0
+# Seconds between the "searching" lines a streamed search sends while it
+# runs; writing them is how a closed connection is noticed, which cancels it
+SEARCH_PROGRESS_INTERVAL = 0.5
+
+search_outcomes = Counter('booksearch_searches_total',
+                          'Searches run (cache misses), by whether they completed', ('outcome',))
+
+class SearchCancelled(Exception):
+    """Raised inside a search that a newer search of the same client replaced"""
+
+class SearchBudget:
+    """Deadline (None for none) and cancellation flag of one running search"""
+
+    def __init__(self, seconds=None, cancel=None):
+        self.deadline = None if seconds is None else time.monotonic() + seconds
+        self.cancel = cancel or threading.Event()
+        self.exceeded = False
+
+    def check(self):
+        """Raise SearchCancelled if cancelled; True once the deadline has passed"""
+        if self.cancel.is_set():
+            raise SearchCancelled()
+        if not self.exceeded and self.deadline is not None and time.monotonic() > self.deadline:
+            self.exceeded = True
+        return self.exceeded
+
+    def remaining(self):
+        """Seconds left, or None without a deadline"""
+        return None if self.deadline is None else max(0.0, self.deadline - time.monotonic())
+
+class BudgetCollector(WrappingCollector):
+    """Stops collecting when the search budget runs out, keeping the matches so far.
+
+    Like Whoosh's TimeLimitCollector with use_alarm=False, but it compares
+    against a deadline every check_every matches instead of running a timer
+    thread per search, and also stops (raising) when the search is cancelled.
+    """
+
+    def __init__(self, child, budget, check_every=256):
+        self.child = child
+        self.budget = budget
+        self.check_every = check_every
+
+    def collect_matches(self):
+        child = self.child
+        for i, sub_docnum in enumerate(child.matches()):
+            if i % self.check_every == 0 and self.budget.check():
+                return
+            child.collect(sub_docnum)
+
+_active_searches = {}  # client session id -> cancel event of its current search
+_active_searches_lock = threading.Lock()
+
+def begin_search(session):
+    """Budget for a new search of a client session, cancelling the session's previous one.
+
+    The session id comes from the page (?sid=...), so a user who types a
+    new query stops the search of the old one. Only searches running in
+    this process can be cancelled; the time budget limits the others.
+    """
+    budget = SearchBudget(SEARCH_TIME_BUDGET or None)
+    if session:
+        with _active_searches_lock:
+            previous = _active_searches.get(session)
+            if previous is not None:
+                previous.set()
+            _active_searches[session] = budget.cancel
+    return budget
+
+def end_search(session, budget):
+    if session:
+        with _active_searches_lock:
+            if _active_searches.get(session) is budget.cancel:
+                del _active_searches[session]
+
+def counted_queries(q):
+    """Leaves and phrases of q whose matches count towards match_count.
+
+    Negated parts (NOT x, the right side of a NOT b) are left out, as they
+    never match on the pages found.
+    """
+    if isinstance(q, Not):
+        return
+    if isinstance(q, AndNot):
+        yield from counted_queries(q.a)
+    elif isinstance(q, Phrase) or q.is_leaf():
+        yield q
+    else:
+        for child in q.children():
+            yield from counted_queries(child)
+
+def count_page_matches(searcher, q, docnums, budget=None):
+    """Exact number of matches of q on each of the pages docnums, from the postings.
+
+    Words count their term frequency, wildcards the frequencies of the
+    terms they expand to, and phrases their occurrences found from term
+    positions. Page text is never loaded. Returns {docnum: count}; if the
+    budget runs out the counts are incomplete.
+    """
+    reader = searcher.reader()
+    counts = dict.fromkeys(docnums, 0)
+    terms = set()
+    matchers = []
+    for leaf in counted_queries(q):
+        if isinstance(leaf, Phrase):
+            matchers.append((leaf.matcher(searcher), lambda m: len(m.spans())))
+        else:
+            terms.update(leaf.existing_terms(reader, phrases=False, expand=True))
+    for fieldname, btext in terms:
+        matchers.append((reader.postings(fieldname, btext), lambda m: m.value_as('frequency')))
+
+    for matcher, count in matchers:
+        if budget is not None and budget.check():
+            break
+        checked = 0
+        while matcher.is_active():
+            docnum = matcher.id()
+            if docnum in counts:
+                counts[docnum] += count(matcher)
+            matcher.next()
+            checked += 1
+            if budget is not None and checked % 4096 == 0 and budget.check():
+                break
+    return counts
+
+def book_hit_order(book):
+    """Sort key of find_book_hits() results: most matches, then most pages, then by name"""
+    filename, docnums, match_count = book
+    return -match_count, -len(docnums), filename
+
+def find_book_hits(searcher, q, budget=None):
+    """Group the pages matching q by book without loading any stored fields.
+
+    Returns (books, total_pages, partial) where books is a list of
+    (filename, docnums, match_count) sorted by number of matches, then by
+    number of matching pages, most first. Only document numbers and
+    postings are read, so this stays cheap however many pages match.
+    partial is True if the budget ran out before all pages were found
+    and counted.
+    """
+    budget = budget or SearchBudget(SEARCH_TIME_BUDGET or None)
+    with timed('search'):
+        collector = searcher.collector(limit=None, groupedby='path', scored=False)
+        searcher.search_with_collector(q, BudgetCollector(collector, budget))
+        results = collector.results()
+        groups = []
+        for path, docnums in results.groups('path').items():
+            filename = Path(path).name
+            # If debug mode is on, only process GA_004.pdf
+            if debugSelectBooks and filename != 'GA_004.pdf':
+                continue
+            groups.append((filename, sorted(docnums)))
+
+    with timed('count'):
+        counts = count_page_matches(searcher, q, [d for _, docnums in groups for d in docnums], budget)
+        books = [(filename, docnums, sum(counts[d] for d in docnums)) for filename, docnums in groups]
+        books.sort(key=book_hit_order)
+    return books, sum(len(docnums) for _, docnums, _ in books), budget.exceeded
+
+def build_book_result(searcher, filename, docnums, match_count, search):
+    """Build the result entry (pages and match count, no snippets) of one book"""
+    q, highlight_terms, search_type, case_sensitive_terms = search
+    with timed('titles'):
+        title = get_pdf_title(filename)
+    with timed('pages'):
+        pages = sorted(searcher.stored_fields(docnum)['page_num'] for docnum in docnums)
+    return {
+        'filename': filename,
+        'title': title,
+        'pages': pages,
+        'score': len(docnums), # This is the page count
+        'match_count': match_count,
+        'search_type': search_type,
+        'highlight_terms': highlight_terms
+    }
+
+def find_page_docnums(searcher, path, page_nums):
+    """Map the requested page numbers of one book to their document numbers.
+
+    The pages of a book are added in order by a single writer, so the
+    book's document numbers are normally sorted by page number and each
+    page is found with a binary search over a handful of stored-field reads.
+    Pages it misses, as in a book whose documents ended up out of order
+    (e.g. written by an older version in several commits), are looked up
+    by reading the page number of every document of the book.
+    """
+    docnums = sorted(searcher.document_numbers(path=path))
+    found = {}
+    for page_num in page_nums:
+        lo, hi = 0, len(docnums)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if searcher.stored_fields(docnums[mid])['page_num'] < page_num:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(docnums) and searcher.stored_fields(docnums[lo])['page_num'] == page_num:
+            found[page_num] = docnums[lo]
+    missing = set(page_nums) - set(found)
+    if missing:
+        for docnum in docnums:
+            page_num = searcher.stored_fields(docnum)['page_num']
+            if page_num in missing:
+                found[page_num] = docnum
+    return found
+
+def highlight_words(searcher, q):
+    """Terms of the content field matched by q, as used by Whoosh's highlighter"""
+    field = searcher.schema['content']
+    return frozenset(field.from_bytes(text) for fieldname, text
+                     in q.existing_terms(searcher.reader(), phrases=True, expand=True)
+                     if fieldname == 'content')
+
+def build_snippet(searcher, search, page_content, words):
+    """Highlighted snippet of one page; words comes from highlight_words()"""
+    q, highlight_terms, search_type, case_sensitive_terms = search
+    if search_type == 'phrase' or case_sensitive_terms:
+        # For phrase/case-sensitive, must use highlight_phrases
+        snippet_text = highlight_phrases(page_content, highlight_terms)
+    else:
+        # Use Whoosh's highlighter for better quality
+        snippet_text = highlight(page_content, words, searcher.schema['content'].analyzer,
+                                 ContextFragmenter(), HtmlFormatter(tagname="b"), top=3)
+    if not snippet_text:
+        snippet_text = page_content[:300] + "..."
+    return snippet_text
+
+# Processes that run a query on the shards in parallel (INDEX_SHARDS > 1).
+# The pool is long-lived and started from request threads, so it uses the
+# spawn start method rather than forking a process that holds locks.
+SEARCH_WORKERS = min(INDEX_SHARDS, os.cpu_count() or 1)
+
+_shard_search_pool = None
+_shard_search_pool_lock = threading.Lock()
+_worker_searchers = {}  # shard directory -> (index, searcher), inside a search worker
+
+def search_shard(dirname, query, seconds=None):
+    """Run a query on one shard; executed in a search worker process.
+
+    Returns (generation, books, total_pages, partial) with books as from
+    find_book_hits(), document numbers local to the shard. seconds is the
+    time budget left to the search (None for no limit).
+    """
+    ix, searcher = _worker_searchers.get(dirname, (None, None))
+    if searcher is None or not searcher.up_to_date():
+        if searcher is not None:
+            searcher.close()
+        ix = open_dir(dirname)
+        searcher = ix.searcher()
+        _worker_searchers[dirname] = (ix, searcher)
+    books, total_pages, partial = find_book_hits(searcher, compile_query(query).q, SearchBudget(seconds))
+    return reader_generation(ix, searcher.reader()), books, total_pages, partial
+
+def shard_search_pool():
+    global _shard_search_pool
+    with _shard_search_pool_lock:
+        if _shard_search_pool is None:
+            _shard_search_pool = ProcessPoolExecutor(max_workers=SEARCH_WORKERS,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+        return _shard_search_pool
+
+def wait_for_shard(future, budget):
+    """Result of a search_shard() future, raising SearchCancelled if the search is cancelled meanwhile"""
+    while True:
+        try:
+            return future.result(timeout=0.1)
+        except FutureTimeout:
+            budget.check()
+
+def find_book_hits_sharded(searcher, query, q, budget=None):
+    """find_book_hits() over all shards, searched in parallel by the search workers.
+
+    searcher is the combined searcher of a ShardedIndex; the shards' book
+    groups are merged with their document numbers moved to its numbering.
+    If a worker saw a different version of a shard than searcher (the index
+    was just committed), the numbers would not line up, so the query is run
+    on searcher in this process instead. Each worker gets the time left in
+    budget; cancelling stops waiting for them, not their work.
+    """
+    budget = budget or SearchBudget(SEARCH_TIME_BUDGET or None)
+    reader = searcher.reader()
+    pool = shard_search_pool()
+    futures = [pool.submit(search_shard, shard_dir(shard), query, budget.remaining())
+               for shard in range(INDEX_SHARDS)]
+    books, total_pages, partial = [], 0, False
+    try:
+        for shard, future in enumerate(futures):
+            with timed('shards'):
+                generation, shard_books, shard_pages, shard_partial = wait_for_shard(future, budget)
+            if generation != reader.shard_generations[shard]:
+                logger.info("Shard %d changed during the search, searching in-process", shard)
+                for other in futures:
+                    other.cancel()
+                return find_book_hits(searcher, q, budget)
+            offset = reader.shard_offsets[shard]
+            books.extend((filename, [docnum + offset for docnum in docnums], match_count)
+                         for filename, docnums, match_count in shard_books)
+            total_pages += shard_pages
+            partial = partial or shard_partial
+    except SearchCancelled:
+        for future in futures:
+            future.cancel()
+        raise
+    books.sort(key=book_hit_order)
+    return books, total_pages, partial
+
+# Recent search outcomes are kept in memory, keyed by index generation and
+# normalized query, so repeated and favorited queries skip parsing, searching
+# and highlighting. Bounded by entry count and by the number of cached pages;
+# each book entry and snippet later built into a cached outcome counts as one
+# more page.
+SEARCH_CACHE_SIZE = 256
+SEARCH_CACHE_MAX_PAGES = 1000000
+
+_search_cache = OrderedDict()
+_search_cache_pages = 0
+_search_cache_lock = threading.Lock()
+
+def normalize_query(query):
+    """Collapse whitespace so trivially different spellings share a cache entry"""
+    return ' '.join(query.split())
+
+def clear_search_cache():
+    """Drop all cached search outcomes; called whenever the index is committed"""
+    global _search_cache_pages
+    with _search_cache_lock:
+        for outcome in _search_cache.values():
+            outcome["cached"] = False
+        _search_cache.clear()
+        _search_cache_pages = 0
+
+def trim_search_cache():
+    """Evict the least recently used outcomes beyond the bounds; called with _search_cache_lock held"""
+    global _search_cache_pages
+    while _search_cache and (len(_search_cache) > SEARCH_CACHE_SIZE
+                             or _search_cache_pages > SEARCH_CACHE_MAX_PAGES):
+        _, evicted = _search_cache.popitem(last=False)
+        evicted["cached"] = False
+        _search_cache_pages -= evicted["size"]
+
+def remember_in_outcome(outcome, kind, key, value):
+    """Store a built book entry ("results") or snippet ("snippets") in an outcome.
+
+    What is added to a cached outcome counts against SEARCH_CACHE_MAX_PAGES,
+    so entries that keep growing after they were cached are evicted too.
+    """
+    global _search_cache_pages
+    with _search_cache_lock:
+        if key in outcome[kind]:
+            return
+        outcome[kind][key] = value
+        outcome["size"] += 1
+        if outcome["cached"]:
+            _search_cache_pages += 1
+            trim_search_cache()
+
+def cached_search(searcher, query):
+    """Return (key, cached outcome or None) for a query, without running it"""
+    with timed('normalize'):
+        key = (searcher.reader().generation(), normalize_query(query))
+    with _search_cache_lock:
+        outcome = _search_cache.get(key)
+        if outcome is not None:
+            _search_cache.move_to_end(key)
+    count_cache_lookup('search', outcome is not None)
+    return key, outcome
+
+def run_search(searcher, query, budget=None):
+    """Parse and run a query, reusing the cached outcome when there is one.
+
+    The outcome is a dict with "search" (from compile_query), "books",
+    "total_pages" and "partial" (from find_book_hits), plus "results" and
+    "snippets" dicts that fill up through remember_in_outcome() as book
+    entries and snippets are built from it. Document numbers are only valid for one index generation,
+    which is why the generation is part of the key. Partial outcomes (the
+    budget ran out) are not cached, so asking again searches again.
+    Raises SearchCancelled if the budget is cancelled.
+    """
+    global _search_cache_pages
+    key, outcome = cached_search(searcher, query)
+    if outcome is not None:
+        return outcome
+
+    with timed('compile'):
+        search = compile_query(key[1])
+    try:
+        if INDEX_SHARDS > 1:
+            books, total_pages, partial = find_book_hits_sharded(searcher, key[1], search.q, budget)
+        else:
+            books, total_pages, partial = find_book_hits(searcher, search.q, budget)
+    except SearchCancelled:
+        search_outcomes.inc(outcome='cancelled')
+        raise
+    search_outcomes.inc(outcome='partial' if partial else 'complete')
+    outcome = {"search": search, "books": books, "total_pages": total_pages, "partial": partial,
+               "results": {}, "snippets": {}, "size": total_pages, "cached": False}
+    if partial:
+        logger.info("Search for %r ran out of its %.1fs budget", key[1], SEARCH_TIME_BUDGET)
+        return outcome
+
+    with _search_cache_lock:
+        if key not in _search_cache:
+            _search_cache[key] = outcome
+            outcome["cached"] = True
+            _search_cache_pages += outcome["size"]
+        trim_search_cache()
+    return outcome
+
+def start_search(searcher, query, budget):
+    """Run run_search() on a thread of its own; returns a Future of its outcome"""
+    future = Future()
+
+    def run():
+        try:
+            future.set_result(run_search(searcher, query, budget))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name='search', daemon=True).start()
+    return future
+
+def get_book_result(searcher, outcome, filename, docnums, match_count):
+    """build_book_result(), memoized in the search outcome"""
+    book = outcome["results"].get(filename)
+    if book is None:
+        book = build_book_result(searcher, filename, docnums, match_count, outcome["search"])
+        remember_in_outcome(outcome, "results", filename, book)
+    return book
+
+@app.route('/snippets')
+def get_snippets():
+    """Highlighted snippets for some pages of one book, built on demand.
+
+    /snippets?q=<query>&file=<filename>&pages=3,17,42 returns
+    {"filename": ..., "snippets": {"3": "...", ...}}. Search results carry no
+    snippets, so highlighting cost follows what the user actually looks at.
+    Never runs the search itself: snippets are cached in the search's cached
+    outcome when there is one, and otherwise built from the compiled query.
+    """
+    query = request.args.get('q', '')
+    filename = request.args.get('file', '')
+    try:
+        page_nums = [int(p) for p in request.args.get('pages', '').split(',') if p.strip()]
+    except ValueError:
+        return jsonify({"error": "pages must be a comma-separated list of page numbers"}), 400
+    if not query or not filename or not page_nums:
+        return jsonify({"error": "q, file and pages are required"}), 400
+    if len(page_nums) > SNIPPET_BATCH_LIMIT:
+        return jsonify({"error": f"At most {SNIPPET_BATCH_LIMIT} pages per request"}), 400
+    if not filename.lower().endswith('.pdf'):
+        filename = filename + '.pdf'
+
+    with searcher_manager.searcher() as searcher:
+        key, outcome = cached_search(searcher, query)
+        if outcome is not None:
+            search, cached = outcome["search"], outcome["snippets"]
+        else:
+            try:
+                with timed('compile'):
+                    search, cached = compile_query(key[1]), {}
+            except Exception as e:
+                return jsonify({"error": str(e)}), 400
+        snippets = {p: cached[(filename, p)] for p in page_nums if (filename, p) in cached}
+        missing = [p for p in page_nums if p not in snippets]
+        cache_requests.inc(len(snippets), cache='snippets', result='hit')
+        cache_requests.inc(len(missing), cache='snippets', result='miss')
+        if missing:
+            with timed('highlight'):
+                words = highlight_words(searcher, search[0])
+                for page_num, docnum in find_page_docnums(searcher, str(Path('data') / filename), missing).items():
+                    page_content = get_page_text(searcher.stored_fields(docnum))
+                    snippets[page_num] = build_snippet(searcher, search, page_content, words)
+                    if outcome is not None:
+                        remember_in_outcome(outcome, "snippets", (filename, page_num), snippets[page_num])
+    with timed('serialize'):
+        return jsonify({"filename": filename, "snippets": snippets})
 
 @app.route('/search')
 def search():
+    """Search the index.
+
+    By default the results are streamed as newline-delimited JSON: a
+    "complete" update with the totals, then batches of SEARCH_BATCH_SIZE
+    books, each built only when its batch is sent. Results hold pages and
+    match counts only; snippets are fetched separately from /snippets.
+
+    With ?cursor=... and/or ?books=... a single page of books is returned
+    as JSON instead, together with the cursor of the next page.
+
+    ?sid=<client session id> lets a newer search from the same page cancel
+    this one. A search that runs out of SEARCH_TIME_BUDGET returns the books
+    found so far with "partial": true. A streamed search is also cancelled
+    when the client disconnects, noticed when the next "searching" progress
+    line (every SEARCH_PROGRESS_INTERVAL) or batch cannot be sent; a paged
+    search only stops for a newer search or the budget.
+    """
     query = request.args.get('q', '')
-    print(f"\nSearch request received for query: {query}")
+    logger.debug("Search request received for query: %s", query)
     if not query:
         return jsonify([])
+    session = request.args.get('sid', '')
+
+    if 'cursor' in request.args or 'books' in request.args:
+        try:
+            offset = int(request.args.get('cursor') or 0)
+            page_size = int(request.args.get('books') or SEARCH_PAGE_BOOKS)
+        except ValueError:
+            return jsonify({"error": "cursor and books must be integers"}), 400
+        if offset < 0 or page_size < 1:
+            return jsonify({"error": "cursor and books must be positive"}), 400
+        budget = begin_search(session)
+        try:
+            page = search_page(query, offset, page_size, budget)
+        finally:
+            end_search(session, budget)
+        with timed('serialize'):
+            return jsonify(page)
+
+    # Only parsing runs before the response starts, so Server-Timing covers
+    # normalize and compile; the stages of the search itself, run while
+    # streaming, are recorded in the /metrics histograms
+    try:
+        with timed('normalize'):
+            normalized = normalize_query(query)
+        with timed('compile'):
+            search = compile_query(normalized)
+    except Exception as e:
+        logger.exception("Unexpected search error")
+        return Response(json.dumps({
+            "status": "complete",
+            "results": [],
+            "total_books": 0,
+            "total_pages": 0,
+            "error": str(e)
+        }) + "\n", mimetype='text/event-stream')
+    logger.debug("Parsed query: %s", search.q)
+
+    budget = begin_search(session)
+    searcher = searcher_manager.acquire()
+
+    def finish():
+        searcher_manager.release(searcher)
+        end_search(session, budget)
 
     def generate_search_results():
-        ix = init_index()
-        with ix.searcher() as searcher:
-            # Check for case-sensitive terms (prefixed with +)
-            # Match + followed by word characters, *, and ? but stop at special operators and parens
-            case_sensitive_terms = re.findall(r'\+([\w*?]+)', query)
-            modified_query = query
-            has_case_sensitive_wildcard = False
-            case_sensitive_wildcard_queries = []  # Store programmatic queries
-            
-            # FIRST: Handle case-sensitive terms (replace + prefix with content_case: field)
-            if case_sensitive_terms:
-                print(f"Case-sensitive terms detected: {case_sensitive_terms}")
-                # Check if any case-sensitive term has a wildcard
-                # Whoosh wildcards are case-insensitive by default, so we need special handling
-                for term in case_sensitive_terms:
-                    if '*' in term:
-                        has_case_sensitive_wildcard = True
-                        print(f"WARNING: Case-sensitive wildcard detected: +{term}")
-                        print(f"         Whoosh wildcards are inherently case-insensitive.")
-                        print(f"         Converting to explicit OR + regex for case-sensitive matching...")
-                        # For Fest*, we want to match: Fest, Feste, Festival, etc.
-                        # Strategy: Build Whoosh query objects programmatically to avoid escaping issues
-                        base_term = term.rstrip('*')  # Remove trailing *
-                        
-                        # Store the info for building the query programmatically later
-                        case_sensitive_wildcard_queries.append({
-                            'original': f'+{term}',
-                            'base_term': base_term,
-                            'type': 'wildcard'
-                        })
-                        
-                        # For now, just replace with a placeholder that we'll handle specially
-                        # Use a unique marker that won't appear in normal text
-                        # Use lowercase because Whoosh lowercases terms in the default 'content' field
-                        placeholder = f'cswild{len(case_sensitive_wildcard_queries)-1}marker'
-                        modified_query = modified_query.replace(f'+{term}', placeholder)
-                        print(f"         Base term: {base_term}")
-                        print(f"         Will build programmatic query for case-sensitive wildcard")
-                    elif '?' in term:
-                        has_case_sensitive_wildcard = True
-                        print(f"WARNING: Case-sensitive wildcard (?) detected: +{term}")
-                        print(f"         Converting to regex for case-sensitive matching...")
-                        # Replace each ? with exactly one word character
-                        # Use \\w which matches any word character (letter, digit, underscore, Unicode letters)
-                        # Using string literal to avoid escaping issues
-                        regex_term = term.replace('?', '\\w')  # Literal backslash-w
-                        modified_query = modified_query.replace(f'+{term}', f'content_case:/{regex_term}/')
-                        print(f"         Converted to regex: content_case:/{regex_term}/")
-                    else:
-                        # No wildcard, use normal field specification
-                        modified_query = modified_query.replace(f'+{term}', f'content_case:{term}')
-                print(f"Modified query after case-sensitive replacement: {modified_query}")
-            
-            # SECOND: Expand wildcard terms: term* -> (term OR term*)
-            # This makes wildcards more intuitive by including the base term
-            # BUT: Don't expand wildcards that are part of field specifications (content_case:term*)
-            # We need to match wildcards that are NOT preceded by "fieldname:"
-            
-            # Find wildcards that are NOT part of a field specification
-            # Match word boundaries followed by word chars and *, but not when preceded by a colon
-            wildcard_pattern = r'(?<![:\w])(\w+)\*'
-            wildcards_found = re.findall(wildcard_pattern, modified_query)
-            if wildcards_found:
-                print(f"Wildcard terms detected (non-field-specific): {wildcards_found}")
-                # Replace each standalone term* with (term OR term*)
-                # This won't match content_case:Fest* because of the negative lookbehind
-                modified_query = re.sub(wildcard_pattern, r'(\1 OR \1*)', modified_query)
-                print(f"Expanded wildcards: {modified_query}")
-            
-            # Use appropriate parser
-            from whoosh import qparser
-            # For case-sensitive terms, we need to use QueryParser that doesn't automatically
-            # search all fields. We'll use a single-field parser on 'content' by default,
-            # but the content_case: field prefix will override it for case-sensitive terms.
-            query_parser = qparser.QueryParser("content", ix.schema, group=OrGroup)
-            
-            # Enable regex plugin for case-sensitive wildcard support
-            # This allows us to use /regex/ syntax in queries
-            query_parser.add_plugin(qparser.RegexPlugin())
-            
-            try:
-                # Determine search type and extract terms for highlighting
-                search_type = 'terms'
-                highlight_terms = []
-                
-                # First, extract quoted phrases
-                phrases = re.findall(r'"([^"]*)"', query)
-                if phrases:
-                    search_type = 'phrase'
-                    highlight_terms.extend([p.strip() for p in phrases if p.strip()])
-                    print(f"Found phrases: {phrases}")
-
-                # Also extract individual terms (after removing quoted sections)
-                # This handles queries like: ("foo bar" OR boo)
-                query_without_quotes = re.sub(r'"[^"]*"', '', query)
-                individual_terms = [
-                    term.lstrip('+').rstrip('*') for term in query_without_quotes.split() 
-                    if term.upper() not in ['AND', 'OR', 'NOT', '(', ')']
-                ]
-                highlight_terms.extend(individual_terms)
-                
-                print(f"All highlight terms: {highlight_terms}")
-
-                q = query_parser.parse(modified_query)
-                print(f"Parsed query (before wildcard substitution): {q}")
-                
-                # If we have case-sensitive wildcard queries, build them programmatically
-                if case_sensitive_wildcard_queries:
-                    from whoosh.query import Term, Regex, Or
-                    print(f"Building programmatic queries for {len(case_sensitive_wildcard_queries)} case-sensitive wildcards")
-                    
-                    # Build the replacement queries
-                    for i, wq in enumerate(case_sensitive_wildcard_queries):
-                        base_term = wq['base_term']
-                        # Create an OR query: exact term OR regex match
-                        exact_query = Term("content_case", base_term)
-                        # For regex, we need to pass the pattern directly without / delimiters
-                        regex_pattern = base_term + r'\w+'
-                        regex_query = Regex("content_case", regex_pattern)
-                        or_query = Or([exact_query, regex_query])
-                        
-                        print(f"   Placeholder {i}: {base_term}* → (Term:{base_term} OR Regex:{regex_pattern})")
-                        
-                        # Replace the placeholder in the parsed query
-                        # We need to traverse the query tree and replace Term nodes that match our placeholder
-                        # Use the same lowercase format we used when creating the placeholder
-                        placeholder_term = f'cswild{i}marker'
-                        q = replace_placeholder_in_query(q, placeholder_term, or_query)
-                    
-                    print(f"Parsed query (after wildcard substitution): {q}")
-                
-                results = searcher.search(q, limit=None)
-                print(f"Found {len(results)} initial results")
-                
-                # Decide which highlighter to use based on result count
-                # Whoosh's highlighter is better but VERY slow with wildcards on large result sets
-                use_fast_highlighter = len(results) > 200
-                if use_fast_highlighter:
-                    print(f"Using fast highlighter (highlight_phrases) due to {len(results)} results")
-                else:
-                    print(f"Using Whoosh's highlighter for better quality with {len(results)} results")
-                
-                # First pass: count unique books for progress tracking
-                unique_books = set()
-                for r in results:
-                    if debugSelectBooks and r['filename'] != 'GA_004.pdf':
-                        continue
-                    unique_books.add(r['filename'])
-                total_books_to_process = len(unique_books)
-                print(f"Total unique books with matches: {total_books_to_process}")
-                
-                # Send initial progress update
-                initial_update = {
-                    "status": "searching",
-                    "message": "Starting search...",
-                    "total_books": total_books_to_process,
-                    "total_pages": 0
-                }
-                print(f"Sending initial update: {initial_update}")
-                yield json.dumps(initial_update) + "\n"
-                
-                # Group results by filename
-                books = {}
-                processed_books = 0
-                total_pages = 0
-                
-                for r in results:
-                    try:
-                        filename = r['filename']
-                        
-                        # If debug mode is on, only process GA_004.pdf
-                        if debugSelectBooks and filename != 'GA_004.pdf':
-                            continue
-                            
-                        if filename not in books:
-                            processed_books += 1
-                            # Send progress update BEFORE expensive operations
-                            progress_update = {
-                                "status": "searching",
-                                "message": f"Processing book {processed_books} of {total_books_to_process}...",
-                                "current_book": processed_books,
-                                "total_books": total_books_to_process,
-                                "total_pages": total_pages
-                            }
-                            print(f"Processing book {filename}")
-                            yield json.dumps(progress_update) + "\n"
-                            
-                            # Now do the expensive operations
-                            books[filename] = {
-                                'filename': filename,
-                                'title': get_pdf_title(filename),
-                                'pages': set(),
-                                'snippets': {},
-                                'score': 0, # This is the page count
-                                'match_count': 0, # This will be the total match count
-                                'search_type': search_type,
-                                'highlight_terms': highlight_terms
-                            }
-                        
-                        books[filename]['pages'].add(r['page_num'])
-                        total_pages += 1
-                        
-                        # Count matches on the current page
-                        page_content_lower = r['content'].lower()
-                        page_match_count = 0
-                        for term in highlight_terms:
-                            page_match_count += page_content_lower.count(term.lower())
-                        books[filename]['match_count'] += page_match_count
-
-                        # Generate snippet using appropriate highlighter
-                        snippet_text = ""
-                        if use_fast_highlighter:
-                            # Fast highlighter for large result sets
-                            snippet_text = highlight_phrases(r['content'], highlight_terms)
-                        else:
-                            # Whoosh's highlighter for better quality on smaller result sets
-                            if search_type == 'phrase' or case_sensitive_terms:
-                                # For phrase/case-sensitive, must use highlight_phrases
-                                snippet_text = highlight_phrases(r['content'], highlight_terms)
-                            else:
-                                # Use Whoosh's highlighter for better quality
-                                snippet_text = r.highlights("content")
-                        
-                        if not snippet_text:
-                            snippet_text = r['content'][:300] + "..."
-                        
-                        books[filename]['snippets'][r['page_num']] = snippet_text
-
-                        books[filename]['score'] += 1 # Increment page count
-                    except Exception as result_error:
-                        print(f"Error processing result: {str(result_error)}")
-                        continue
+        # Stops at a yield when the client disconnects (the server closes
+        # the generator) or between batches when a newer search cancels it.
+        # The search runs on its own thread meanwhile, and is cancelled if
+        # the generator is closed before it is done.
+        future = None
+        try:
+            # Sent before searching, so the first byte does not wait for it
+            yield json.dumps({
+                "status": "searching",
+                "message": "Searching...",
+                "total_books": 0,
+                "total_pages": 0
+            }) + "\n"
 
-                # Convert to list and sort by score
-                hits = list(books.values())
-                hits.sort(key=lambda x: x['score'], reverse=True)
-                
-                # Convert page sets to sorted lists
-                for hit in hits:
-                    hit['pages'] = sorted(list(hit['pages']))
-                
-                # Send results in batches of 10 books
-                batch_size = 10
-                total_hits = len(hits)
-                
-                # Send initial completion status
-                yield json.dumps({
-                    "status": "complete",
-                    "total_books": total_hits,
-                    "total_pages": total_pages,
-                    "batch_count": (total_hits + batch_size - 1) // batch_size
-                }) + "\n"
-
-                # Send results in batches
-                for i in range(0, total_hits, batch_size):
-                    batch = hits[i:i + batch_size]
+            future = start_search(searcher, query, budget)
+            started = time.perf_counter()
+            while True:
+                try:
+                    outcome = future.result(timeout=SEARCH_PROGRESS_INTERVAL)
+                    break
+                except FutureTimeout:
                     yield json.dumps({
+                        "status": "searching",
+                        "message": f"Searching... ({time.perf_counter() - started:.0f}s)",
+                        "total_books": 0,
+                        "total_pages": 0
+                    }) + "\n"
+                except SearchCancelled:
+                    yield json.dumps({"status": "cancelled"}) + "\n"
+                    return
+            books, total_pages = outcome["books"], outcome["total_pages"]
+            total_books = len(books)
+            logger.debug("Found %d pages in %d books", total_pages, total_books)
+
+            # Totals are known before any page is loaded, so the completion
+            # status goes out first and books are built batch by batch
+            batch_size = SEARCH_BATCH_SIZE
+            yield json.dumps({
+                "status": "complete",
+                "total_books": total_books,
+                "total_pages": total_pages,
+                "batch_count": (total_books + batch_size - 1) // batch_size,
+                "partial": outcome["partial"],
+                "time_budget": SEARCH_TIME_BUDGET
+            }) + "\n"
+
+            for i in range(0, total_books, batch_size):
+                if budget.cancel.is_set():
+                    logger.debug("Search for %r replaced by a newer one", query)
+                    return
+                batch = [get_book_result(searcher, outcome, filename, docnums, match_count)
+                         for filename, docnums, match_count in books[i:i + batch_size]]
+                with timed('serialize'):
+                    line = json.dumps({
                         "status": "batch",
                         "batch_number": i // batch_size + 1,
                         "results": batch
                     }) + "\n"
+                yield line
 
-                print(f"Search complete. Sent {total_hits} books in {(total_hits + batch_size - 1) // batch_size} batches")
+            logger.debug("Search complete. Sent %d books in %d batches",
+                         total_books, (total_books + batch_size - 1) // batch_size)
 
-            except Exception as e:
-                print(f"Unexpected search error: {str(e)}")
-                yield json.dumps({
-                    "status": "complete",
-                    "results": [],
-                    "total_books": 0,
-                    "total_pages": 0,
-                    "error": str(e)
-                }) + "\n"
+        except Exception as e:
+            logger.exception("Unexpected search error")
+            yield json.dumps({
+                "status": "complete",
+                "results": [],
+                "total_books": 0,
+                "total_pages": 0,
+                "error": str(e)
+            }) + "\n"
+        finally:
+            if future is not None and not future.done():
+                # Closed early (client gone): stop the search at its next
+                # budget check; finish() may only release the searcher after
+                logger.debug("Search for %r abandoned by the client", query)
+                budget.cancel.set()
+                wait([future])
+
+    response = Response(generate_search_results(), mimetype='text/event-stream')
+    # Called when the server closes the response, also if the stream is never read
+    response.call_on_close(finish)
+    return response
+
+def search_page(query, offset, page_size, budget=None):
+    """Return one page of book results for the paginated /search mode.
+
+    Grouping only touches document numbers; pages are loaded just for the
+    page_size books starting at offset, so the response time does not
+    depend on how many pages match overall.
+    """
+    with searcher_manager.searcher() as searcher:
+        try:
+            outcome = run_search(searcher, query, budget)
+        except SearchCancelled:
+            return {"status": "cancelled", "results": [], "total_books": 0, "total_pages": 0,
+                    "next_cursor": None}
+        except Exception as e:
+            logger.exception("Unexpected search error")
+            return {"status": "error", "results": [], "total_books": 0, "total_pages": 0,
+                    "next_cursor": None, "error": str(e)}
+        books, total_pages = outcome["books"], outcome["total_pages"]
+        results = [get_book_result(searcher, outcome, filename, docnums, match_count)
+                   for filename, docnums, match_count in books[offset:offset + page_size]]
+    next_offset = offset + page_size
+    return {
+        "status": "page",
+        "results": results,
+        "total_books": len(books),
+        "total_pages": total_pages,
+        "partial": outcome["partial"],
+        "next_cursor": str(next_offset) if next_offset < len(books) else None
+    }
+
+@app.route('/metrics')
+def metrics():
+    """Timings and cache statistics of this process in the Prometheus text format.
+
+    With several server worker processes (serve.py) each keeps its own
+    numbers, so a scrape shows the worker that answered it.
+    """
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
 
-    return Response(generate_search_results(), mimetype='text/event-stream')
+    # Hit ratios, including compile_query()'s lru_cache, which counts itself
+    info = compile_query.cache_info()
+    lookups = {'query': [info.hits, info.misses]}
+    for (cache, result), count in sorted(cache_requests.items()):
+        lookups.setdefault(cache, [0, 0])[0 if result == 'hit' else 1] += count
+    lines.append("# HELP booksearch_cache_hit_ratio Share of cache lookups that were hits")
+    lines.append("# TYPE booksearch_cache_hit_ratio gauge")
+    for cache, (hits, misses) in lookups.items():
+        if hits + misses:
+            lines.append(f'booksearch_cache_hit_ratio{{cache="{cache}"}} {hits / (hits + misses):.4f}')
+    lines.append("# HELP booksearch_search_cache_entries Search outcomes held in the search cache")
+    lines.append("# TYPE booksearch_search_cache_entries gauge")
+    with _search_cache_lock:
+        lines.append(f"booksearch_search_cache_entries {len(_search_cache)}")
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
-    app.run(debug=True, port=8087) 
\ No newline at end of file
+    # Development server; serve.py runs the app for several users at once
+    app.run(debug=os.environ.get('BOOKSEARCH_DEBUG', '1') != '0', port=int(os.environ.get('BOOKSEARCH_PORT', 8087)))
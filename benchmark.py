@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""
+Benchmark indexing throughput and search latency on a synthetic corpus.
+
+Generates a reproducible set of PDFs (German-like text, same seed -> same
+books) in a scratch directory, then measures:
+  - pages/s of a full rebuild, first without and then with the text cache,
+    and of index_pdf() re-indexing single books
+  - latency and time to first byte of /search, streamed and paginated, for
+    a mix of phrase, +Case, wildcard and boolean queries (plus the queries
+    in favorites.json), with the result cache cleared (cold) and filled (warm)
+
+Results are written as JSON; pass an earlier result file with --compare to
+see how the medians changed.
+
+  python benchmark.py --books 40 --pages 200 --output before.json
+  python benchmark.py --books 40 --pages 200 --output after.json --compare before.json
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from urllib.parse import urlencode
+
+REPO_DIR = Path(__file__).resolve().parent
+
+# Words the query mix looks for; the rest of the vocabulary is made up
+# from German-looking syllables
+SEED_WORDS = ("der die das und nicht ein eine ist zu mit sich des auf für als auch es an "
+              "Mensch Menschen Welt Geist Seele Leben Erde Sonne Mond Tod Götter Äther Wärme "
+              "Fest fest festlich Feste chemisch chemische Chemismus geistig ganz viele damit "
+              "ich Muskel Muskeln Leib Wesen Kräfte").split()
+SYLLABLES = ("ge be ver er zer ent an auf aus ein mit nach vor über un wirk licht "
+             "kraft leb seel geist welt sinn zeit raum bild schau wahr heit keit ung "
+             "lich isch en er el ig sam bar ern ach ich ör äu ü ß st sch").split()
+# Phrases planted into some pages, so the phrase queries have hits that also
+# cross page breaks
+PLANTED_PHRASES = ["damit der Mensch ganz Mensch", "eine Welt", "viele Menschen",
+                   "die geistige Welt", "der chemische Äther"]
+
+QUERY_MIX = [
+    "Geist",
+    "welt",
+    '"damit der mensch ganz mensch"',
+    '"die geistige Welt"',
+    "+Geist",
+    "+Fest*",
+    '+"eine Welt"',
+    "fest*",
+    "m?nsch",
+    "chem*isch",
+    "Welt AND Geist",
+    "Sonne OR Mond",
+    "Leben NOT Tod",
+    "(Sonne OR Mond) AND Erde NOT Tod",
+]
+
+def make_vocabulary(rnd, size):
+    """SEED_WORDS followed by made-up words, about a third of them capitalized nouns"""
+    words = list(SEED_WORDS)
+    seen = set(words)
+    while len(words) < size:
+        word = "".join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(2, 4)))
+        if rnd.random() < 0.35:
+            word = word.capitalize()
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+def pdf_bytes(pages, title):
+    """A minimal PDF with one Helvetica text page per string in pages"""
+    objs = []
+
+    def add(obj):
+        objs.append(obj)
+        return len(objs)
+
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+    contents = []
+    for text in pages:
+        words = text.split()
+        lines = [" ".join(words[i:i + 12]) for i in range(0, len(words), 12)]
+        leading = min(14, 740 / max(len(lines), 1))
+        ops = [f"BT /F1 {min(11, leading * 0.8):.1f} Tf {leading:.1f} TL 40 790 Td"]
+        for line in lines:
+            escaped = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            ops.append(f"({escaped}) Tj T*")
+        ops.append("ET")
+        stream = "\n".join(ops).encode("cp1252", errors="replace")
+        contents.append(add(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream"))
+    pages_id = len(objs) + len(pages) + 1
+    kids = [add(b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] "
+                b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (pages_id, font, c))
+            for c in contents]
+    add(b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % k for k in kids) + b"] /Count %d >>" % len(kids))
+    catalog = add(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+    info = add(b"<< /Title (" + title.encode("cp1252") + b") >>")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for num, obj in enumerate(objs, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % num + obj + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objs) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root %d 0 R /Info %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objs) + 1, catalog, info, xref)
+    return bytes(out)
+
+def generate_corpus(data_dir, books, pages, words, vocabulary, seed):
+    """Write books GA_001.pdf ... into data_dir; returns the number of pages written"""
+    rnd = random.Random(seed)
+    vocab = make_vocabulary(rnd, vocabulary)
+    # Zipf-like word frequencies, as in real text
+    weights = [1 / rank for rank in range(1, len(vocab) + 1)]
+    data_dir.mkdir(parents=True, exist_ok=True)
+    for book in range(books):
+        book_pages = []
+        for _ in range(pages):
+            page = rnd.choices(vocab, weights, k=words)
+            if rnd.random() < 0.05:
+                phrase = rnd.choice(PLANTED_PHRASES).split()
+                # Near the end of the page about half the time, so some run onto the next one
+                at = rnd.randint(max(0, words - 3), words) if rnd.random() < 0.5 else rnd.randint(0, words)
+                page[at:at] = phrase
+            book_pages.append(" ".join(page))
+        title = f"GA {book + 1} - Synthetisches Buch {book + 1}"
+        (data_dir / f"GA_{book + 1:03d}.pdf").write_bytes(pdf_bytes(book_pages, title))
+    return books * pages
+
+def percentiles(samples):
+    """p50/p95/p99 (nearest rank), mean and count of samples in milliseconds"""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered) + 0.5) - 1))]
+
+    return {"count": len(ordered),
+            "p50_ms": round(rank(50) * 1000, 3),
+            "p95_ms": round(rank(95) * 1000, 3),
+            "p99_ms": round(rank(99) * 1000, 3),
+            "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3)}
+
+@contextlib.contextmanager
+def quiet(enabled):
+    """Only let the app log warnings and errors while measuring"""
+    if not enabled:
+        yield
+        return
+    logger = logging.getLogger('booksearch')
+    level = logger.level
+    logger.setLevel(logging.WARNING)
+    try:
+        yield
+    finally:
+        logger.setLevel(level)
+
+def benchmark_indexing(app_module, total_pages, single_books):
+    """Time full rebuilds without and with the text cache, and index_pdf() per book"""
+    pdf_files = sorted(Path('data').glob('*.pdf'))
+    results = {}
+    for name, keep_text_cache in (("rebuild_cold", False), ("rebuild_cached_text", True)):
+        shutil.rmtree(app_module.INDEX_DIR, ignore_errors=True)
+        if not keep_text_cache:
+            shutil.rmtree(app_module.TEXT_CACHE_PATH.parent, ignore_errors=True)
+        for shard in range(app_module.INDEX_SHARDS):
+            app_module.init_index(shard)
+        start = time.perf_counter()
+        errors, backends = 0, {}
+        for update in app_module.index_pdfs(pdf_files, optimize=True):
+            errors += 'error' in update
+            for backend, stats in update.get('backends', {}).items():
+                totals = backends.setdefault(backend, {"pages": 0, "seconds": 0.0})
+                totals["pages"] += stats["pages"]
+                totals["seconds"] += stats["seconds"]
+        elapsed = time.perf_counter() - start
+        results[name] = {"seconds": round(elapsed, 3), "books": len(pdf_files), "pages": total_pages,
+                         "pages_per_second": round(total_pages / elapsed, 1), "errors": errors}
+        if backends:
+            # Per extraction process; pages read by the fallback were read by the main backend first
+            results[name]["backends"] = {
+                backend: {"pages": t["pages"], "seconds": round(t["seconds"], 3),
+                          "pages_per_second": round(t["pages"] / t["seconds"], 1) if t["seconds"] else None}
+                for backend, t in backends.items()}
+
+    # Re-indexing single books: replaces their documents, text comes from the cache
+    pages_per_book = total_pages / max(len(pdf_files), 1)
+    times = []
+    for pdf_path in pdf_files[:single_books]:
+        start = time.perf_counter()
+        app_module.index_pdf(pdf_path)
+        times.append(time.perf_counter() - start)
+    if times:
+        results["index_pdf"] = {**percentiles(times),
+                                "pages_per_second": round(pages_per_book * len(times) / sum(times), 1)}
+    return results
+
+def timed_get(client, url):
+    """(seconds to the first chunk of the body, seconds to the end of it) for one GET"""
+    start = time.perf_counter()
+    response = client.get(url, buffered=False)
+    try:
+        chunks = iter(response.response)
+        first = next(chunks, None)
+        ttfb = time.perf_counter() - start
+        if first is not None:
+            for _ in chunks:
+                pass
+        total = time.perf_counter() - start
+    finally:
+        response.close()
+    if response.status_code != 200:
+        raise RuntimeError(f"GET {url} returned {response.status_code}")
+    return ttfb, total
+
+def benchmark_queries(app_module, queries, cold_repeat, warm_repeat, page_size):
+    """Latency and TTFB per query and mode, cold (caches cleared) and warm"""
+    client = app_module.app.test_client()
+    modes = {"stream": {}, "page": {"books": page_size}}
+    per_query = {}
+    combined = {}
+    for mode, extra in modes.items():
+        for query in queries:
+            url = '/search?' + urlencode({"q": query, **extra})
+            timings = {}
+            for phase, repeat in (("cold", cold_repeat), ("warm", warm_repeat)):
+                ttfbs, totals = [], []
+                for _ in range(repeat):
+                    if phase == "cold":
+                        app_module.clear_search_cache()
+                        app_module.compile_query.cache_clear()
+                    ttfb, total = timed_get(client, url)
+                    ttfbs.append(ttfb)
+                    totals.append(total)
+                timings[phase] = {"latency": percentiles(totals), "ttfb": percentiles(ttfbs)}
+                bucket = combined.setdefault(f"{mode}_{phase}", {"latency": [], "ttfb": []})
+                bucket["latency"] += totals
+                bucket["ttfb"] += ttfbs
+            if mode == "page":
+                # Hit counts, to see that the corpus exercises the query at all
+                hits = client.get(url).get_json()
+                timings["hits"] = {"books": hits.get("total_books"), "pages": hits.get("total_pages")}
+            per_query[f"{mode}:{query}"] = timings
+    overall = {name: {"latency": percentiles(b["latency"]), "ttfb": percentiles(b["ttfb"])}
+               for name, b in combined.items()}
+    return overall, per_query
+
+def load_favorite_queries():
+    try:
+        with open(REPO_DIR / 'favorites.json', encoding='utf-8') as f:
+            return [fav['query'] for fav in json.load(f) if fav.get('query')]
+    except (OSError, ValueError):
+        return []
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(current, previous):
+    """Print how the medians of current differ from those of an earlier run"""
+    def rows(result):
+        for name, stats in result["indexing"].items():
+            yield f"indexing {name} pages/s", stats.get("pages_per_second")
+        for name, stats in result["queries"]["overall"].items():
+            yield f"search {name} latency p50 ms", stats["latency"].get("p50_ms")
+            yield f"search {name} ttfb p50 ms", stats["ttfb"].get("p50_ms")
+            yield f"search {name} latency p95 ms", stats["latency"].get("p95_ms")
+
+    before = dict(rows(previous))
+    print(f"\n{'metric':<42} {'before':>10} {'after':>10} {'change':>8}")
+    for metric, value in rows(current):
+        old = before.get(metric)
+        change = f"{(value - old) / old * 100:+.1f}%" if old and value is not None else ""
+        print(f"{metric:<42} {old if old is not None else '-':>10} {value:>10} {change:>8}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark indexing and search on a synthetic corpus")
+    parser.add_argument('--books', type=int, default=20, help="books in the corpus (default 20)")
+    parser.add_argument('--pages', type=int, default=100, help="pages per book (default 100)")
+    parser.add_argument('--words', type=int, default=300, help="words per page (default 300)")
+    parser.add_argument('--vocabulary', type=int, default=5000, help="distinct words (default 5000)")
+    parser.add_argument('--seed', type=int, default=1, help="corpus random seed (default 1)")
+    parser.add_argument('--repeat', type=int, default=20, help="warm runs per query (default 20)")
+    parser.add_argument('--cold-repeat', type=int, default=5, help="cold runs per query (default 5)")
+    parser.add_argument('--page-size', type=int, default=20, help="books per page in paginated mode")
+    parser.add_argument('--single-books', type=int, default=5, help="books re-indexed with index_pdf()")
+    parser.add_argument('--workdir', help="directory for the corpus and index (default: a temporary one)")
+    parser.add_argument('--keep', action='store_true', help="keep the temporary directory")
+    parser.add_argument('--output', help="result JSON file (default benchmark-<time>.json)")
+    parser.add_argument('--compare', help="earlier result JSON to compare with")
+    parser.add_argument('--verbose', action='store_true', help="show the app's log messages below WARNING")
+    args = parser.parse_args()
+
+    started = datetime.now(timezone.utc)
+    output = Path(args.output or f"benchmark-{started:%Y%m%d-%H%M%S}.json").resolve()
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            previous = json.load(f)
+
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix='booksearch-bench-')).resolve()
+    workdir.mkdir(parents=True, exist_ok=True)
+    print(f"Generating {args.books} books x {args.pages} pages in {workdir}")
+    shutil.rmtree(workdir / 'data', ignore_errors=True)
+    total_pages = generate_corpus(workdir / 'data', args.books, args.pages, args.words,
+                                  args.vocabulary, args.seed)
+
+    # app uses data/, index/ and cache/ relative to the working directory
+    os.chdir(workdir)
+    sys.path.insert(0, str(REPO_DIR))
+    import app as app_module
+
+    try:
+        print("Indexing...")
+        with quiet(not args.verbose):
+            indexing = benchmark_indexing(app_module, total_pages, args.single_books)
+        for name, stats in indexing.items():
+            print(f"  {name}: {stats['pages_per_second']} pages/s")
+
+        queries = list(dict.fromkeys(QUERY_MIX + load_favorite_queries()))
+        print(f"Searching ({len(queries)} queries)...")
+        with quiet(not args.verbose):
+            overall, per_query = benchmark_queries(app_module, queries, args.cold_repeat,
+                                                   args.repeat, args.page_size)
+        for name, stats in overall.items():
+            print(f"  {name}: p50 {stats['latency']['p50_ms']} ms, p95 {stats['latency']['p95_ms']} ms, "
+                  f"p99 {stats['latency']['p99_ms']} ms, ttfb p50 {stats['ttfb']['p50_ms']} ms")
+    finally:
+        if not args.workdir and not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {
+        "started": started.isoformat(),
+        "git_revision": git_revision(),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpus": os.cpu_count()},
+        "settings": {"index_shards": app_module.INDEX_SHARDS,
+                     "extractor": app_module.extractor_id(),
+                     "extract_workers": app_module.EXTRACT_WORKERS,
+                     "page_overlap_words": app_module.PAGE_OVERLAP_WORDS},
+        "corpus": {"books": args.books, "pages_per_book": args.pages, "words_per_page": args.words,
+                   "vocabulary": args.vocabulary, "seed": args.seed, "pages": total_pages},
+        "indexing": indexing,
+        "queries": {"repeat": args.repeat, "cold_repeat": args.cold_repeat, "page_size": args.page_size,
+                    "overall": overall, "per_query": per_query},
+    }
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print(f"Results written to {output}")
+    if previous is not None:
+        compare(result, previous)
+
+if __name__ == '__main__':
+    main()
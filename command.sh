@@ -91,6 +91,6 @@ if [ $? -ne 0 ]; then
     exit 1
 fi
 
-# Start the Flask server
-echo "Starting Flask server..."
-python app.py
+# Start the server
+echo "Starting server..."
+python serve.py
@@ -0,0 +1,27 @@
+# gunicorn settings for serve.py (POSIX); see serve.py for the options
+import os
+
+bind = f"{os.environ.get('BOOKSEARCH_HOST', '127.0.0.1')}:{os.environ.get('BOOKSEARCH_PORT', '8087')}"
+
+# Several processes so searches of different users run in parallel, each
+# with a few threads for the short requests (PDFs, pages, titles, job status).
+# Search result streams end when the search does, so they only hold a
+# thread for that long; indexing progress is polled by the UI instead of
+# streamed.
+workers = int(os.environ.get('BOOKSEARCH_WORKERS', min(os.cpu_count() or 1, 4)))
+worker_class = 'gthread'
+threads = int(os.environ.get('BOOKSEARCH_THREADS', 8))
+timeout = 120
+
+# Import the app once in the master; workers share its memory pages. The
+# index itself is opened per worker (after the fork) and its files are
+# memory-mapped, so all workers read the same pages from the OS cache.
+preload_app = True
+
+def post_worker_init(worker):
+    # Open the searcher before the first request instead of during it
+    from app import searcher_manager
+    try:
+        searcher_manager.release(searcher_manager.acquire())
+    except Exception as e:
+        worker.log.warning(f"Could not open the search index yet: {e}")
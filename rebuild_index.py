@@ -3,6 +3,10 @@
 Completely rebuild the search index from scratch.
 Use this when the schema has changed or the index is corrupted.
 
+Page text extracted earlier is reused from cache/page_text.sqlite3, so only
+PDFs that are new or have changed content (or were extracted with other
+backends, see EXTRACT_BACKEND in app.py) are extracted again.
+
 IMPORTANT: Run this script with the virtual environment activated:
   - Linux/Mac: source venv/bin/activate
   - Windows: venv\\Scripts\\activate
@@ -23,6 +27,7 @@ def check_dependencies():
         import flask
         import whoosh
         import pdfplumber
+        import pypdfium2
         return True
     except ImportError as e:
         print("ERROR: Required dependencies not found!")
@@ -44,27 +49,46 @@ def check_dependencies():
         return False
 
 def rebuild_index():
-    """Delete and rebuild the entire search index"""
+    """Delete and rebuild the entire search index, unless another process is indexing"""
+    from app import index_writer_lock, IndexLockedError
+    
+    # The web app's indexing jobs take the same lock, so only one process
+    # writes to the index at a time
+    try:
+        with index_writer_lock():
+            rebuild_locked_index()
+    except IndexLockedError as e:
+        print(f"ERROR: {e}")
+        sys.exit(1)
+
+def rebuild_locked_index():
+    """Delete and rebuild the entire search index; the caller holds the indexing lock"""
     # Import here to avoid issues if schema is invalid
-    from app import index_pdf
-    from whoosh.index import create_in
-    from app import schema
+    from app import (index_pdfs, init_index, extractor_id, EXTRACT_WORKERS, INDEX_DIR, INDEX_SHARDS,
+                     INDEX_JOB_LOCK_PATH)
     
     data_dir = Path('data')
-    index_dir = Path('index')
+    index_dir = Path(INDEX_DIR)
     
-    # Remove old index
+    # Remove old index, except the lock file we are holding
     if index_dir.exists():
         print(f"Removing old index directory: {index_dir}")
-        shutil.rmtree(index_dir)
+        for path in index_dir.iterdir():
+            if path == INDEX_JOB_LOCK_PATH:
+                continue
+            if path.is_dir():
+                shutil.rmtree(path)
+            else:
+                path.unlink()
     
     # Create fresh index directory
     print(f"Creating new index directory: {index_dir}")
     index_dir.mkdir(exist_ok=True)
     
-    # Create new index with current schema
-    print("Creating new index with updated schema...")
-    ix = create_in(str(index_dir), schema)
+    # Create new index (every shard of it) with current schema
+    print(f"Creating new index with updated schema ({INDEX_SHARDS} shard{'s' if INDEX_SHARDS != 1 else ''})...")
+    for shard in range(INDEX_SHARDS):
+        init_index(shard)
     
     # Index all PDFs
     pdf_files = sorted(data_dir.glob('*.pdf'))
@@ -74,17 +98,25 @@ def rebuild_index():
         print("No PDF files found in data directory!")
         return
     
-    print(f"\nIndexing {total} PDF files...")
+    print(f"\nIndexing {total} PDF files using {EXTRACT_WORKERS} extraction processes ({extractor_id()})...")
     print("-" * 60)
     
-    for i, pdf_file in enumerate(pdf_files, 1):
-        print(f"[{i:3d}/{total}] {pdf_file.name}")
-        try:
-            index_pdf(pdf_file)
-        except Exception as e:
-            print(f"  ERROR: {e}")
+    # Books finish in whatever order the worker processes complete them
+    backends = {}
+    for update in index_pdfs(pdf_files, optimize=True):
+        source = "cached text" if update['cached'] else "extracted"
+        print(f"[{update['current']:3d}/{total}] {update['filename']} ({update['pages']} pages, {source})")
+        if 'error' in update:
+            print(f"  ERROR: {update['error']}")
+        for backend, stats in update.get('backends', {}).items():
+            totals = backends.setdefault(backend, {"pages": 0, "seconds": 0.0})
+            totals["pages"] += stats["pages"]
+            totals["seconds"] += stats["seconds"]
     
     print("-" * 60)
+    for backend, totals in backends.items():
+        rate = totals["pages"] / totals["seconds"] if totals["seconds"] else 0
+        print(f"{backend}: {totals['pages']} pages, {rate:.1f} pages/s per extraction process")
     print(f"\n✓ Index rebuild complete! Indexed {total} PDF files.")
     print("\nYou can now start the application and test the case-sensitive search.")
     print("Example: +Fest will match 'Fest' but not 'fest'")
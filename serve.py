@@ -0,0 +1,41 @@
+"""Run Book Search for several users at once.
+
+    python serve.py [--host HOST] [--port PORT] [--workers N] [--threads N]
+
+On Linux and macOS this runs gunicorn with gunicorn.conf.py (several worker
+processes, each with a pool of threads). On Windows, where gunicorn does
+not run, it serves from one waitress process with a pool of threads.
+The options can also be set with BOOKSEARCH_HOST, BOOKSEARCH_PORT,
+BOOKSEARCH_WORKERS and BOOKSEARCH_THREADS. `python app.py` still starts
+the Flask development server.
+"""
+import argparse
+import os
+import sys
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve Book Search with a production WSGI server")
+    parser.add_argument('--host', help="address to listen on (default 127.0.0.1)")
+    parser.add_argument('--port', type=int, help="port to listen on (default 8087)")
+    parser.add_argument('--workers', type=int, help="worker processes (gunicorn only)")
+    parser.add_argument('--threads', type=int, help="threads per worker process")
+    args = parser.parse_args()
+
+    for option, name in (('host', 'BOOKSEARCH_HOST'), ('port', 'BOOKSEARCH_PORT'),
+                         ('workers', 'BOOKSEARCH_WORKERS'), ('threads', 'BOOKSEARCH_THREADS')):
+        if getattr(args, option) is not None:
+            os.environ[name] = str(getattr(args, option))
+
+    if sys.platform == 'win32':
+        from waitress import serve
+        from app import app
+        host = os.environ.get('BOOKSEARCH_HOST', '127.0.0.1')
+        port = int(os.environ.get('BOOKSEARCH_PORT', 8087))
+        print(f"Serving on http://{host}:{port}")
+        serve(app, host=host, port=port, threads=int(os.environ.get('BOOKSEARCH_THREADS', 16)))
+    else:
+        config = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gunicorn.conf.py')
+        os.execvp(sys.executable, [sys.executable, '-m', 'gunicorn', '-c', config, 'app:app'])
+
+if __name__ == '__main__':
+    main()
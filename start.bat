@@ -30,8 +30,8 @@ for /f "tokens=5" %%a in ('netstat -aon ^| findstr :8087') do (
     )
 )
 
-:: Start the Flask server
-echo Starting Flask server on http://localhost:8087...
+:: Start the server
+echo Starting server on http://localhost:8087...
 echo Press Ctrl+C to stop the server
 echo.
-python app.py 
\ No newline at end of file
+python serve.py
\ No newline at end of file
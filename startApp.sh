@@ -1,2 +1,2 @@
 #!/bin/bash
-source venv/bin/activate && kill -9 $(lsof -ti:8087) 2>/dev/null; python app.py
\ No newline at end of file
+source venv/bin/activate && kill -9 $(lsof -ti:8087) 2>/dev/null; python serve.py
\ No newline at end of file
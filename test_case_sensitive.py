@@ -7,6 +7,7 @@ Run this AFTER rebuilding the index with rebuild_index.py
 from whoosh.index import open_dir
 from whoosh.qparser import QueryParser
 from pathlib import Path
+from app import get_page_text
 
 def test_case_sensitive_search():
     """Test case-sensitive search functionality"""
@@ -58,7 +59,7 @@ def test_case_sensitive_search():
                     print("\nFirst few matches:")
                     for i, hit in enumerate(results[:3], 1):
                         # Get the actual text around the match
-                        text = hit['content'][:200]  # First 200 chars
+                        text = get_page_text(hit.fields())[:200]  # First 200 chars
                         # Find 'fest' or 'Fest' in the text
                         fest_lower = text.count('fest')
                         fest_upper = text.count('Fest')
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Regression test for indexing long books in chunks.
+A long book read in chunks while short books are committed around it must
+keep its pages in document order, and every page of it must be found by
+find_page_docnums and /snippets. Builds its own small corpus and index in
+a temporary directory; run with python test_chunked_indexing.py or pytest.
+"""
+
+import contextlib
+import os
+import tempfile
+from pathlib import Path
+
+import app
+from benchmark import pdf_bytes
+
+LONG_PAGES = 60
+SHORT_BOOKS = 12
+LOOKUP_PAGES = [1, 5, 30, 55, 60]
+
+def page_words(page_num):
+    return f"common words on page{page_num} of the book " * 20
+
+@contextlib.contextmanager
+def scratch_tree(**settings):
+    """Run in an empty temporary directory with some app settings changed"""
+    settings['searcher_manager'] = app.SearcherManager()  # Opens the scratch index
+    saved = {name: getattr(app, name) for name in settings}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            for name, value in settings.items():
+                setattr(app, name, value)
+            app.clear_search_cache()
+            Path('data').mkdir()
+            app.init_index()
+            yield Path(tmp)
+        finally:
+            for name, value in saved.items():
+                setattr(app, name, value)
+            app.clear_search_cache()
+            os.chdir(cwd)
+
+def book_page_nums(searcher, path):
+    return [searcher.stored_fields(d)['page_num'] for d in sorted(searcher.document_numbers(path=path))]
+
+def write_corpus():
+    """One book of LONG_PAGES pages and SHORT_BOOKS books of 3 pages; returns their paths"""
+    long_path = Path('data') / 'long.pdf'
+    long_path.write_bytes(pdf_bytes([page_words(n) for n in range(1, LONG_PAGES + 1)], 'Long'))
+    short_paths = []
+    for i in range(SHORT_BOOKS):
+        short_paths.append(Path('data') / f'short{i:02d}.pdf')
+        short_paths[-1].write_bytes(pdf_bytes([page_words(n) for n in range(1, 4)], f'Short {i}'))
+    return long_path, short_paths
+
+def check_long_book(long_path):
+    with app.init_index().searcher() as searcher:
+        assert book_page_nums(searcher, str(long_path)) == list(range(1, LONG_PAGES + 1))
+        found = app.find_page_docnums(searcher, str(long_path), LOOKUP_PAGES)
+        assert sorted(found) == LOOKUP_PAGES, found
+
+    client = app.app.test_client()
+    pages = ','.join(str(p) for p in LOOKUP_PAGES)
+    snippets = client.get(f'/snippets?q=common&file={long_path.name}&pages={pages}').get_json()['snippets']
+    assert sorted(int(p) for p in snippets) == LOOKUP_PAGES, snippets
+
+def test_interleaved_books_keep_page_order():
+    """Batch commits of short books don't split a long book that is still being read.
+
+    Feeds index_pdfs() an order extract_books() can produce: a short book
+    completes after every chunk of the long book but the last. Committing
+    the writer each time would leave the book in segments of 12-13 pages
+    and a last one of 11, and the final merge orders segments by size, so
+    the end of the book would come first.
+    """
+    with scratch_tree(EXTRACT_CHUNK_PAGES=10, INDEX_COMMIT_BATCH=1):
+        long_path, short_paths = write_corpus()
+
+        def interleaved_events(pdf_files, workers=None, settings=None):
+            book = app.extract_book(long_path, settings)
+            yield long_path, 'book', book
+            shorts = iter(short_paths)
+            chunks = app.page_chunks(book, settings)
+            for number, (first, last) in enumerate(chunks):
+                yield long_path, 'pages', app.extract_page_range(long_path, first, last, settings)
+                if number < len(chunks) - 1:
+                    short_path = next(shorts)
+                    yield short_path, 'book', app.extract_book(short_path, settings)
+            yield long_path, 'done', None
+            for short_path in shorts:
+                yield short_path, 'book', app.extract_book(short_path, settings)
+
+        extract_books = app.extract_books
+        app.extract_books = interleaved_events
+        try:
+            updates = list(app.index_pdfs([long_path] + short_paths))
+        finally:
+            app.extract_books = extract_books
+        assert not [u for u in updates if 'error' in u], updates
+        check_long_book(long_path)
+
+def test_chunked_indexing_with_workers():
+    """The same corpus indexed by the extraction pool"""
+    with scratch_tree(EXTRACT_CHUNK_PAGES=10, INDEX_COMMIT_BATCH=1):
+        long_path, short_paths = write_corpus()
+        updates = list(app.index_pdfs([long_path] + short_paths, workers=2))
+        assert not [u for u in updates if 'error' in u], updates
+        check_long_book(long_path)
+
+def test_commits_between_long_books():
+    """With several long books in the run, the batch is still committed after each of them.
+
+    Commits wait while a long book is half written; extract_books() opens
+    one at a time, so there is a point between any two long books at which
+    the writer commits and saves the manifest.
+    """
+    with scratch_tree(EXTRACT_CHUNK_PAGES=10, INDEX_COMMIT_BATCH=1):
+        long_paths = []
+        for i in range(6):
+            long_paths.append(Path('data') / f'long{i}.pdf')
+            long_paths[-1].write_bytes(pdf_bytes([page_words(n) for n in range(1, 41)], f'Long {i}'))
+        saves = []
+        save_manifest = app.save_manifest
+        app.save_manifest = lambda manifest: (saves.append(set(manifest)), save_manifest(manifest))
+        try:
+            updates = list(app.index_pdfs(long_paths, workers=2))
+        finally:
+            app.save_manifest = save_manifest
+        assert not [u for u in updates if 'error' in u], updates
+        # One save after every book, each with one more book in the manifest
+        # (load_manifest() saves the empty manifest of the new index first)
+        assert [len(names) for names in saves if names] == list(range(1, len(long_paths) + 1)), saves
+        with app.init_index().searcher() as searcher:
+            for path in long_paths:
+                assert book_page_nums(searcher, str(path)) == list(range(1, 41))
+
+def test_workers_use_runtime_settings():
+    """Spawned workers extract with the settings of the indexing process, not the module defaults"""
+    cache_path = Path('elsewhere') / 'text.sqlite3'
+    with scratch_tree(EXTRACT_CHUNK_PAGES=10, EXTRACT_FALLBACK_BACKEND=None, TEXT_CACHE_PATH=cache_path):
+        long_path, short_paths = write_corpus()
+        paths = [long_path] + short_paths[:3]
+        for cached in (False, True):
+            updates = list(app.index_pdfs(paths, workers=2))
+            assert not [u for u in updates if 'error' in u], updates
+            assert all(u["cached"] == cached for u in updates), updates
+            assert all(set(u.get("backends", {})) <= {'pdfium'} for u in updates), updates
+        assert cache_path.exists() and not Path('cache').exists()
+        conn = app.open_text_cache(cache_path)
+        try:
+            keys = {key for key, in conn.execute('SELECT file_hash FROM books')}
+        finally:
+            conn.close()
+        assert keys == {f"{app.file_hash(path)}:pdfium" for path in paths}, keys
+        check_long_book(long_path)
+
+def test_page_lookup_out_of_order():
+    """find_page_docnums() finds every page of a book whose documents are out of page order"""
+    with scratch_tree():
+        path = str(Path('data') / 'split.pdf')
+        for pages in (range(31, LONG_PAGES + 1), range(1, 31)):
+            writer = app.init_index().writer()
+            app.add_pdf_pages(writer, Path(path), [(n, page_words(n)) for n in pages])
+            writer.commit()
+        with app.init_index().searcher() as searcher:
+            assert book_page_nums(searcher, path) != list(range(1, LONG_PAGES + 1))
+            found = app.find_page_docnums(searcher, path, LOOKUP_PAGES)
+            assert sorted(found) == LOOKUP_PAGES, found
+            for page_num, docnum in found.items():
+                assert searcher.stored_fields(docnum)['page_num'] == page_num
+
+if __name__ == '__main__':
+    print("=" * 80)
+    print("CHUNKED INDEXING TEST")
+    print("=" * 80)
+    for test in (test_interleaved_books_keep_page_order, test_chunked_indexing_with_workers,
+                 test_commits_between_long_books, test_workers_use_runtime_settings,
+                 test_page_lookup_out_of_order):
+        test()
+        print(f"OK   {test.__name__}")
+    print("=" * 80)
+    print("TEST COMPLETE")
+    print("=" * 80)
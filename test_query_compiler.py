@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Test script for the search syntax compiler (compile_query in app.py).
+Checks the compiled Whoosh query and the highlight terms for the benchmark
+query mix and the saved favorites, and how case-sensitive wildcards expand
+on a small in-memory index. Needs no index on disk; run with
+python test_query_compiler.py or pytest.
+"""
+
+import json
+import re
+from pathlib import Path
+
+from whoosh.filedb.filestore import RamStorage
+from whoosh.query import Term, Phrase, Prefix, Wildcard, And, Or, AndNot, NullQuery
+from app import compile_query, schema, PageBreakPhrase, CaseSensitiveWildcard
+from benchmark import QUERY_MIX
+
+def phrase(*words):
+    """What an unquoted-case phrase compiles to: on a page or across a page break"""
+    return Or([Phrase('content', list(words)), PageBreakPhrase('content_span', list(words))])
+
+# query -> (compiled query, highlight terms, search type, case-sensitive terms)
+EXPECTED = {
+    # Benchmark query mix
+    "Geist": (Term('content', 'geist'), ('Geist',), 'terms', ()),
+    "welt": (Term('content', 'welt'), ('welt',), 'terms', ()),
+    '"damit der mensch ganz mensch"': (
+        phrase('damit', 'der', 'mensch', 'ganz', 'mensch'),
+        ('damit der mensch ganz mensch',), 'phrase', ()),
+    '"die geistige Welt"': (phrase('die', 'geistige', 'welt'), ('die geistige Welt',), 'phrase', ()),
+    "+Geist": (Term('content_case', 'Geist'), ('Geist',), 'terms', ('Geist',)),
+    "+Fest*": (CaseSensitiveWildcard('content_case', 'Fest*'), ('Fest',), 'terms', ('Fest',)),
+    '+"eine Welt"': (Phrase('content_case', ['eine', 'Welt']), ('eine Welt',), 'phrase', ('eine Welt',)),
+    "fest*": (Prefix('content', 'fest'), ('fest',), 'terms', ()),
+    "m?nsch": (Wildcard('content', 'm?nsch'), ('m?nsch',), 'terms', ()),
+    "chem*isch": (Wildcard('content', 'chem*isch'), ('chem*isch',), 'terms', ()),
+    "Welt AND Geist": (And([Term('content', 'welt'), Term('content', 'geist')]), ('Welt', 'Geist'), 'terms', ()),
+    "Sonne OR Mond": (Or([Term('content', 'sonne'), Term('content', 'mond')]), ('Sonne', 'Mond'), 'terms', ()),
+    "Leben NOT Tod": (AndNot(Term('content', 'leben'), Term('content', 'tod')), ('Leben',), 'terms', ()),
+    "(Sonne OR Mond) AND Erde NOT Tod": (
+        AndNot(And([Or([Term('content', 'sonne'), Term('content', 'mond')]), Term('content', 'erde')]),
+               Term('content', 'tod')),
+        ('Sonne', 'Mond', 'Erde'), 'terms', ()),
+    # favorites.json
+    '"eine Welt" AND "viele Menschen" AND Tod': (
+        And([phrase('eine', 'welt'), phrase('viele', 'menschen'), Term('content', 'tod')]),
+        ('eine Welt', 'viele Menschen', 'Tod'), 'phrase', ()),
+    "chemismus": (Term('content', 'chemismus'), ('chemismus',), 'terms', ()),
+    "chemisch* AND leben* AND äther AND götter": (
+        And([Prefix('content', 'chemisch'), Prefix('content', 'leben'),
+             Term('content', 'äther'), Term('content', 'götter')]),
+        ('chemisch', 'leben', 'äther', 'götter'), 'terms', ()),
+    "Wärme* AND ich AND muskel*": (
+        And([Prefix('content', 'wärme'), Term('content', 'ich'), Prefix('content', 'muskel')]),
+        ('Wärme', 'ich', 'muskel'), 'terms', ()),
+    # Edge cases of the syntax
+    "Geist NOT (Sonne OR Mond)": (
+        AndNot(Term('content', 'geist'), Or([Term('content', 'sonne'), Term('content', 'mond')])),
+        ('Geist',), 'terms', ()),
+    "ganz-mensch": (Or([Term('content', 'ganz'), Term('content', 'mensch')]), ('ganz-mensch',), 'terms', ()),
+    "*": (NullQuery, (), 'terms', ()),
+    '"': (NullQuery, (), 'terms', ()),
+}
+
+def test_expected_queries():
+    """Every query compiles to the expected query and highlight terms"""
+    for query, (q, highlight_terms, search_type, case_sensitive_terms) in EXPECTED.items():
+        compiled = compile_query(query)
+        assert compiled.q == q, f"{query!r}: {compiled.q!r} != {q!r}"
+        assert compiled.highlight_terms == highlight_terms, f"{query!r}: {compiled.highlight_terms!r}"
+        assert compiled.search_type == search_type, f"{query!r}: {compiled.search_type!r}"
+        assert compiled.case_sensitive_terms == case_sensitive_terms, f"{query!r}: {compiled.case_sensitive_terms!r}"
+
+def test_query_mix_and_favorites_covered():
+    """The benchmark queries and the saved favorites all have an expected result above"""
+    queries = list(QUERY_MIX)
+    favorites = Path('favorites.json')
+    if favorites.exists():
+        queries += [f['query'] for f in json.loads(favorites.read_text(encoding='utf-8'))]
+    missing = [query for query in queries if query not in EXPECTED]
+    assert not missing, f"No expected result for {missing}"
+
+def test_wildcards_are_anchored():
+    """? and * patterns match whole terms, not parts of them"""
+    pattern = re.compile(compile_query("m?nsch").q._get_pattern())
+    assert pattern.match('mensch')
+    assert not pattern.match('menschen')
+    assert not pattern.match('ein-mensch')
+
+def test_case_sensitive_wildcard_paths_agree():
+    """A prefix pattern (Foo*) expands like the same pattern through the regex path (F?o*, *oo*)"""
+    ix = RamStorage().create_index(schema)
+    writer = ix.writer()
+    writer.add_document(path='x', content='x', content_case='Foo Foobar Foo.bar Foo_x Fooß foo FOO Fxo')
+    writer.commit()
+    with ix.reader() as reader:
+        def expand(pattern):
+            return {b.decode('utf-8') for b in CaseSensitiveWildcard('content_case', pattern)._btexts(reader)}
+        prefix = expand('Foo*')
+        assert prefix == {'Foo', 'Foobar', 'Foo_x', 'Fooß'}, prefix
+        assert prefix == {t for t in expand('F?o*') if t.startswith('Foo')}
+        assert prefix == {t for t in expand('*oo*') if t.startswith('Foo')}
+
+def test_whitespace_variants_compile_alike():
+    assert compile_query("Welt  AND Geist").q == compile_query("Welt AND Geist").q
+
+if __name__ == '__main__':
+    print("=" * 80)
+    print("QUERY COMPILER TEST")
+    print("=" * 80)
+    for test in (test_expected_queries, test_query_mix_and_favorites_covered,
+                 test_wildcards_are_anchored, test_case_sensitive_wildcard_paths_agree,
+                 test_whitespace_variants_compile_alike):
+        test()
+        print(f"OK   {test.__name__}")
+    print("=" * 80)
+    print("TEST COMPLETE")
+    print("=" * 80)
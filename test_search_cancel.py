@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Test that a streamed search stops when its client goes away.
+Closing the /search stream while the search is still running must cancel
+the search and release its searcher and session. Uses an empty index in a
+temporary directory and a stand-in for the search itself; run with
+python test_search_cancel.py or pytest.
+"""
+
+import contextlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+import app
+
+@contextlib.contextmanager
+def slow_search_tree():
+    """An empty scratch index whose searches run until they are cancelled (at most 5 s)"""
+    started, cancelled = threading.Event(), threading.Event()
+
+    def find_book_hits(searcher, q, budget=None):
+        started.set()
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            try:
+                budget.check()
+            except app.SearchCancelled:
+                cancelled.set()
+                raise
+            time.sleep(0.01)
+        return [], 0, False
+
+    saved = {name: getattr(app, name) for name in ('find_book_hits', 'searcher_manager')}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            app.find_book_hits = find_book_hits
+            app.searcher_manager = app.SearcherManager()
+            app.init_index()
+            yield started, cancelled
+        finally:
+            for name, value in saved.items():
+                setattr(app, name, value)
+            app.clear_search_cache()
+            os.chdir(cwd)
+
+def test_closing_the_stream_cancels_the_search():
+    with slow_search_tree() as (started, cancelled):
+        client = app.app.test_client()
+        response = client.get('/search?q=slow&sid=test-cancel', buffered=False)
+        lines = iter(response.response)
+        assert json.loads(next(lines))["status"] == "searching"
+        # A progress line arrives while the search is still running
+        assert json.loads(next(lines))["status"] == "searching"
+        assert started.is_set() and not cancelled.is_set()
+
+        start = time.monotonic()
+        response.close()  # What the server does when the client has gone
+        assert cancelled.is_set(), "the search kept running"
+        assert time.monotonic() - start < 1
+        assert 'test-cancel' not in app._active_searches, "end_search() did not run"
+        assert not app.searcher_manager._users, "the searcher was not released"
+
+def test_complete_stream_releases_the_searcher():
+    with slow_search_tree() as (started, cancelled):
+        app.find_book_hits = lambda searcher, q, budget=None: ([], 0, False)
+        client = app.app.test_client()
+        response = client.get('/search?q=fast&sid=test-complete')
+        statuses = [json.loads(line)["status"] for line in response.get_data(as_text=True).splitlines()]
+        assert statuses == ["searching", "complete"], statuses
+        response.close()
+        assert 'test-complete' not in app._active_searches
+        assert not app.searcher_manager._users
+
+if __name__ == '__main__':
+    print("=" * 80)
+    print("SEARCH CANCEL TEST")
+    print("=" * 80)
+    for test in (test_closing_the_stream_cancels_the_search, test_complete_stream_releases_the_searcher):
+        test()
+        print(f"OK   {test.__name__}")
+    print("=" * 80)
+    print("TEST COMPLETE")
+    print("=" * 80)